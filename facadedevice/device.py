@@ -2,17 +2,27 @@
 
 # Imports
 import time
+import json
+import threading
 import collections
+from functools import partial
+from timeit import default_timer
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
 
 # Graph imports
-from facadedevice.graph import triplet, Graph, INVALID
+from facadedevice.graph import triplet, Graph, Columns, INVALID
 
 # Exception imports
 from facadedevice.exception import to_dev_failed, context
 
 # Utils imports
 from facadedevice.utils import EnhancedDevice, aggregate_qualities
+from facadedevice.utils import aggregate_quality_array
 from facadedevice.utils import get_default_attribute_value
+from facadedevice.utils import get_remote_cache, attributes_from_wildcard
+from facadedevice.utils import check_attribute, get_attribute_info
+from facadedevice.utils import check_command, get_command_info
+from facadedevice.utils import make_subcommand, ConflatingQueue
 
 # Object imports
 from facadedevice.objects import class_object, local_attribute
@@ -20,6 +30,13 @@ from facadedevice.objects import class_object, local_attribute
 # Tango imports
 from tango.server import command
 from tango import DevFailed, DevState, EventData, EventType, DispLevel
+from tango import AutoTangoMonitor
+
+
+# Columnar results
+
+combined_columns = collections.namedtuple(
+    'combined_columns', ('attrs', 'values', 'stamps', 'qualities', 'present'))
 
 
 # Proxy metaclass
@@ -72,6 +89,8 @@ class Facade(_Facade):
     It also provides a few helpers:
 
     - `self.graph`: act as a `<key, node>` dictionnary
+    - `self.graph.transaction()`: a context manager to merge the updates
+      of several nodes into a single propagation
     - `self.get_combined_results`: return the subresults of a combined
       attribute
 
@@ -90,11 +109,66 @@ class Facade(_Facade):
     - the connection status
     - the list of all event subscriptions
     - the exception history
+    - the rule cache statistics
+    - the counts of suppressed updates
+    - the remote cache statistics
+    - the pending background subscriptions
+    - the event queue statistics
+    - the event push statistics (if `async_push` is set)
+
+    And an expert command called `GetProfile` that returns the execution
+    statistics of the rules as a JSON string (if `graph_profiling` is set).
     """
 
     # Reasons to ignore for errors in events
     reasons_to_ignore = ["API_PollThreadOutOfSync"]
 
+    # Number of threads used to compute independent nodes in parallel
+    # (rules have to be thread-safe, and not acquire the device monitor)
+    graph_workers = 0
+
+    # Record the execution statistics of the rules (see GetProfile)
+    graph_profiling = False
+
+    # Number of threads used to run the remote checks of the configure
+    # phase concurrently (0 to run them sequentially), and their timeout
+    remote_check_workers = 8
+    remote_check_timeout = 30.
+
+    # Local file caching the remote attribute configs, command infos and
+    # wildcard expansions (None to disable), and the lifetime of its entries
+    remote_cache_path = None
+    remote_cache_ttl = 24 * 3600.
+
+    # Expand the wildcards using a single device per device class
+    # (faster, but the dynamic attributes are ignored)
+    wildcard_by_class = False
+
+    # Number of threads used to subscribe to the remote attributes once the
+    # device is initialized (0 to subscribe while connecting), and the
+    # period for retrying the failed subscriptions
+    subscription_workers = 0
+    subscription_retry_period = 10.
+
+    # Maximum number of nodes with a pending event in the event queue (0 to
+    # process the events in the tango callbacks). The queue only keeps the
+    # latest event of each node, and a single thread processes them in
+    # batches, with one propagation per batch. The events of new nodes are
+    # still queued above that size, and counted as overflow.
+    event_queue_size = 0
+
+    # Overload policy of the event queue: maximum number of events per
+    # batch (0 for no limit), and queue depth above which the events of
+    # nodes with a priority lower than event_shed_priority are put aside
+    # until the backlog is halved (0 to disable)
+    event_batch_size = 0
+    event_shed_threshold = 0
+    event_shed_priority = 1
+
+    # Push the change and archive events from a dedicated thread, keeping
+    # only the latest pending value of each attribute
+    async_push = False
+
     # Properties
 
     @property
@@ -103,14 +177,30 @@ class Facade(_Facade):
 
     # Helper
 
-    def get_combined_results(self, name):
+    def get_combined_results(self, name, columns=False):
         """Return the subresults of a given combined attribute.
 
         It produces an ordered dictionnary of <attribute_name, triplet>.
+
+        If columns is True, it produces a `combined_columns` named tuple
+        of attribute names and read-only numpy arrays of values, stamps,
+        (integer) qualities, and presence mask. Those arrays are views of
+        the attribute storage if it is columnar.
         """
         subnodes = self.graph.subnodes(name)
-        return collections.OrderedDict(
-            (node.remote_attr, node.result()) for node in subnodes)
+        if not columns:
+            return collections.OrderedDict(
+                (node.remote_attr, node.result()) for node in subnodes)
+        # Columnar results
+        store = getattr(self.graph[name], 'columns', None)
+        if store is None:
+            store = Columns(len(subnodes))
+            for index, node in enumerate(subnodes):
+                store.update(index, node)
+        return combined_columns(
+            [node.remote_attr for node in subnodes],
+            *map(store.view, (
+                store.values, store.stamps, store.qualities, store.present)))
 
     def _get_default_value(self, attr):
         dtype = attr.get_data_type()
@@ -124,40 +214,254 @@ class Facade(_Facade):
 
     # Initialization
 
+    def init_device(self):
+        self._subscription_lock = threading.Lock()
+        self._subscription_timers = []
+        self._subscription_executor = None
+        super(Facade, self).init_device()
+        # Process the events and subscribe in the background, once the
+        # device is initialized
+        if self.connected:
+            self._start_push_queue()
+            self._start_event_queue()
+            self._start_subscriptions()
+
     def safe_init_device(self):
         """Initialize the device."""
         # Init data structures
-        self._graph = Graph()
+        self._graph = Graph(
+            profiling=self.graph_profiling,
+            timer_lock=partial(AutoTangoMonitor, self))
         self._subcommand_dict = {}
+        self._cached_queries = []
+        self._wildcard_memo = {}
+        self._pending_subscriptions = []
+        self._push_stats = collections.Counter()
+        self._push_queue = ConflatingQueue() if self.async_push else None
+        self._event_queue = None
+        if self.event_queue_size:
+            self._event_queue = ConflatingQueue(
+                self.event_queue_size,
+                self.event_shed_threshold,
+                self.event_shed_priority)
+        self._subscription_status = collections.OrderedDict()
+        self._remote_cache_stats = collections.Counter()
+        self._remote_cache = None
+        if self.remote_cache_path:
+            self._remote_cache = get_remote_cache(
+                self.remote_cache_path, self.remote_cache_ttl)
+        # Parallel evaluation
+        if self.graph_workers:
+            self._graph.executor = ThreadPoolExecutor(self.graph_workers)
         # Get properties
         with context('getting', 'properties'):
             super(Facade, self).safe_init_device()
-        # Configure
-        for value in self._class_dict.values():
-            with context('configuring', value):
-                value.configure(self)
+        # Configure (and collect the remote checks)
+        self._remote_checks = []
+        try:
+            for value in self._class_dict.values():
+                with context('configuring', value):
+                    self._configuring = value
+                    value.configure(self)
+        finally:
+            checks, self._remote_checks = self._remote_checks, None
+        # Run the remote checks
+        self._run_remote_checks(checks)
+        self._save_remote_cache()
         # Build graph
         with context('building', self._graph):
             self._graph.build()
+            self._set_priorities()
         # Connect
         for value in self._class_dict.values():
             with context('connecting', value):
                 value.connect(self)
+        # Check the cached results in the background
+        self._validate_cached_queries()
+
+    # Remote checks
+
+    def defer_remote_check(self, func, callback=None):
+        """Run a remote check at the end of the configure phase.
+
+        The checks run concurrently, and the callback (if any) is called
+        with the result of func. Outside of the configure phase, or if
+        `remote_check_workers` is 0, the check runs immediately.
+        """
+        checks = getattr(self, '_remote_checks', None)
+        if checks is None or not self.remote_check_workers:
+            result = func()
+            if callback is not None:
+                callback(result)
+            return
+        checks.append((self._configuring, func, callback))
+
+    def _run_remote_checks(self, checks):
+        if not checks:
+            return
+        started = {}
+
+        def run(index, func):
+            started[index] = default_timer()
+            return func()
+
+        workers = min(self.remote_check_workers, len(checks))
+        executor = ThreadPoolExecutor(workers)
+        futures = [
+            executor.submit(run, index, func)
+            for index, (_, func, _) in enumerate(checks)]
+        # Report the first error in the configure order
+        try:
+            for index, (origin, _, callback) in enumerate(checks):
+                with context('configuring', origin):
+                    result = self._wait_remote_check(
+                        futures[index], started, index)
+                    if callback is not None:
+                        callback(result)
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _wait_remote_check(self, future, started, index):
+        # The timeout starts when the check starts
+        while not future.done():
+            start = started.get(index, default_timer())
+            remaining = start + self.remote_check_timeout - default_timer()
+            if remaining <= 0:
+                msg = "The remote check timed out after {} seconds"
+                raise TimeoutError(msg.format(self.remote_check_timeout))
+            wait([future], timeout=remaining)
+        return future.result()
+
+    # Remote cache
+
+    def _cached_remote_query(self, key, func):
+        # Cache disabled
+        if self._remote_cache is None:
+            return func()
+        # Cache miss
+        result = self._remote_cache.get(key)
+        if result is None:
+            self._remote_cache_stats['miss(es)'] += 1
+            result = func()
+            # Empty results (e.g. wildcards) are queried again
+            if result:
+                self._remote_cache.set(key, result)
+            return result
+        # Cache hit (checked once the device is initialized)
+        self._remote_cache_stats['hit(s)'] += 1
+        self._cached_queries.append((key, func, result))
+        return result
+
+    def _check_remote_attribute(self, name, writable=False):
+        if self._remote_cache is None:
+            return check_attribute(name, writable)
+        kind = 'writable_attribute' if writable else 'attribute'
+        return self._cached_remote_query(
+            '{}:{}'.format(kind, name),
+            partial(get_attribute_info, name, writable))
+
+    def _check_remote_command(self, name):
+        if self._remote_cache is None:
+            return check_command(name)
+        return self._cached_remote_query(
+            'command:{}'.format(name), partial(get_command_info, name))
+
+    def _make_remote_subcommand(self, name, attr=False):
+        if self._remote_cache is None:
+            return make_subcommand(name, attr)
+        if attr:
+            self._check_remote_attribute(name)
+        else:
+            self._check_remote_command(name)
+        return make_subcommand(name, attr, check=False)
+
+    def _expand_wildcard(self, wildcard):
+        # Shared by the objects of the device
+        if wildcard not in self._wildcard_memo:
+            func = partial(
+                attributes_from_wildcard, wildcard,
+                workers=self.remote_check_workers,
+                by_class=self.wildcard_by_class)
+            self._wildcard_memo[wildcard] = self._cached_remote_query(
+                'wildcard:{}'.format(wildcard), lambda: list(func()))
+        return list(self._wildcard_memo[wildcard])
+
+    def _save_remote_cache(self):
+        if self._remote_cache is None:
+            return
+        try:
+            self._remote_cache.save()
+        except Exception as exc:
+            msg = "Exception while saving the remote cache"
+            self.ignore_exception(exc, msg)
+
+    def _validate_cached_queries(self):
+        queries, self._cached_queries = self._cached_queries, []
+        if not queries:
+            return
+        token = self._validation_token = object()
+        workers = max(1, min(self.remote_check_workers, len(queries)))
+        executor = ThreadPoolExecutor(workers)
+        for key, func, cached in queries:
+            future = executor.submit(func)
+            future.add_done_callback(
+                partial(self._on_cached_query_validated, token, key, cached))
+        executor.shutdown(wait=False)
+
+    def _on_cached_query_validated(self, token, key, cached, future):
+        with AutoTangoMonitor(self):
+            # The device has been re-initialized since
+            if token is not getattr(self, '_validation_token', None):
+                return
+            # The cached result is up-to-date
+            exc = future.exception()
+            if exc is None and future.result() == cached:
+                return
+            # Update the cache
+            self._remote_cache_stats['stale'] += 1
+            if exc is None:
+                self._remote_cache.set(key, future.result())
+            else:
+                self._remote_cache.discard(key)
+            self._save_remote_cache()
+            # The device has to be re-initialized
+            if exc is None:
+                msg = "The cached result for {} is outdated"
+                exc = ValueError(msg.format(key))
+            msg = "Exception while checking the cached result for {} "
+            msg += "(run Init to reconfigure the device)"
+            self.register_exception(exc, msg.format(key))
 
     # Event subscription
 
     def _subscribe_for_node(self, attr, node):
+        # Background subscription
+        if self.subscription_workers:
+            self._subscription_status[attr] = "connecting"
+            self._pending_subscriptions.append((attr, node))
+            return
+        eid = self._subscribe_node_events(attr, node)
+        return self._event_dict[eid][3]
+
+    def _subscribe_node_events(self, attr, node):
+        # Queue the events without locking the device
+        if self._event_queue is not None:
+            callback = partial(
+                self._event_queue.put, node,
+                priority=getattr(node, 'priority', 0),
+                source=attr.rsplit('/', 1)[0])
+            locked = False
+        else:
+            callback, locked = partial(self._on_node_event, node), True
         try:
-            self.subscribe_event(
-                attr,
-                EventType.CHANGE_EVENT,
-                lambda event: self._on_node_event(node, event))
+            eid = self.subscribe_event(
+                attr, EventType.CHANGE_EVENT, callback, locked=locked)
         except DevFailed:
             try:
-                self.subscribe_event(
-                    attr,
-                    EventType.PERIODIC_EVENT,
-                    lambda event: self._on_node_event(node, event))
+                eid = self.subscribe_event(
+                    attr, EventType.PERIODIC_EVENT, callback, locked=locked)
             except DevFailed:
                 msg = "Can't subscribe to event for attribute {}"
                 self.info_stream(msg.format(attr))
@@ -165,11 +469,121 @@ class Facade(_Facade):
             else:
                 msg = "Subscribed to periodic event for attribute {}"
                 self.info_stream(msg.format(attr))
-                return EventType.PERIODIC_EVENT
+                return eid
         else:
             msg = "Subscribed to change event for attribute {}"
             self.info_stream(msg.format(attr))
-            return EventType.CHANGE_EVENT
+            return eid
+
+    def _start_subscriptions(self):
+        pending, self._pending_subscriptions = self._pending_subscriptions, []
+        if not pending:
+            return
+        workers = min(self.subscription_workers, len(pending))
+        self._subscription_executor = ThreadPoolExecutor(workers)
+        self._subscription_token = token = object()
+        for attr, node in pending:
+            self._subscription_executor.submit(
+                self._subscribe_in_background, token, attr, node)
+
+    def _subscribe_in_background(self, token, attr, node):
+        try:
+            eid = self._subscribe_node_events(attr, node)
+        except Exception as exc:
+            with self._subscription_lock:
+                if token is not self._subscription_token:
+                    return
+                # Retry later
+                timer = threading.Timer(
+                    self.subscription_retry_period,
+                    self._retry_subscription, (token, attr, node))
+                timer.daemon = True
+                self._subscription_timers.append(timer)
+                timer.start()
+                msg = "retrying every {} seconds after an error"
+                self._subscription_status[attr] = msg.format(
+                    self.subscription_retry_period)
+            msg = "Exception while subscribing to {}"
+            self.ignore_exception(exc, msg.format(attr))
+            with AutoTangoMonitor(self):
+                node.set_exception(exc)
+            return
+        with self._subscription_lock:
+            # The device has been deleted in the meantime
+            if token is not self._subscription_token:
+                self.unsubscribe_event(eid)
+                return
+            self._subscription_status.pop(attr, None)
+
+    def _retry_subscription(self, token, attr, node):
+        with self._subscription_lock:
+            if token is not self._subscription_token:
+                return
+            self._subscription_executor.submit(
+                self._subscribe_in_background, token, attr, node)
+
+    def _stop_subscriptions(self):
+        with self._subscription_lock:
+            self._subscription_token = None
+            for timer in self._subscription_timers:
+                timer.cancel()
+            del self._subscription_timers[:]
+            if self._subscription_executor is not None:
+                self._subscription_executor.shutdown(wait=False)
+                self._subscription_executor = None
+
+    # Event queue
+
+    def _set_priorities(self):
+        # The priorities are only used by the event queue
+        if self._event_queue is None:
+            return
+        # The nodes take the highest priority of their subscribers: the
+        # subscribers have a higher rank, so they are processed first
+        graph = self._graph
+        for name in sorted(graph, key=graph.rank, reverse=True):
+            node = graph[name]
+            node.priority = max(
+                [getattr(node, 'priority', 0)] +
+                [subscriber.priority
+                 for subscriber in graph.subscribers(name)])
+
+    def _start_event_queue(self):
+        if self._event_queue is None:
+            return
+        thread = threading.Thread(
+            target=self._process_event_queue, args=(self._event_queue,))
+        thread.daemon = True
+        thread.start()
+
+    def _process_event_queue(self, queue):
+        while True:
+            batch = queue.get_batch(self.event_batch_size)
+            if batch is None:
+                return
+            with AutoTangoMonitor(self):
+                # The device has been deleted in the meantime
+                if queue is not self._event_queue:
+                    return
+                self._process_events(batch)
+
+    def _process_events(self, batch):
+        try:
+            with self.graph.transaction():
+                for node, event in batch:
+                    try:
+                        self._on_node_event(node, event)
+                    except Exception as exc:
+                        msg = "Exception while processing an event for {}"
+                        self.ignore_exception(exc, msg.format(node))
+        except Exception as exc:
+            msg = "Exception while processing a batch of events"
+            self.ignore_exception(exc, msg)
+
+    def _stop_event_queue(self):
+        queue, self._event_queue = self._event_queue, None
+        if queue is not None:
+            queue.close()
 
     # Event callback
 
@@ -202,6 +616,7 @@ class Facade(_Facade):
 
     def _read_from_node(self, node, attr=None):
         """Used when reading an attribute"""
+        self.graph.evaluate(node)
         if node.result() is None:
             return
         value, stamp, quality = node.result()
@@ -213,7 +628,7 @@ class Facade(_Facade):
 
     def _write_to_node(self, node, value):
         """Used when writing a local attribute"""
-        node.set_result(triplet(value))
+        node.set_result(triplet.unchecked(value, time.time()))
 
     def _run_proxy_command(self, key, value):
         """Used when writing a proxy attribute"""
@@ -226,6 +641,17 @@ class Facade(_Facade):
         subcommand = self._subcommand_dict[key]
         return ctx(subcommand, *values)
 
+    def _has_event_subscriber(self, name):
+        """Used to know if a lazy attribute is observed"""
+        try:
+            check = self.is_there_subscriber
+        # Not available before pytango 9.3, assume there is a subscriber
+        except AttributeError:  # pragma: no cover
+            return True
+        return any(
+            check(name, event_type) for event_type in
+            (EventType.CHANGE_EVENT, EventType.ARCHIVE_EVENT))
+
     # Controlled callbacks
 
     def _run_callback(self, ctx, func, node):
@@ -251,11 +677,15 @@ class Facade(_Facade):
         values, stamps, qualities = zip(*results)
         # Invalid quality
         if any(quality == INVALID for quality in qualities):
-            return triplet(None, max(stamps), INVALID)
+            return triplet.unchecked(None, max(stamps), INVALID)
         # Run function
+        cache = getattr(node, 'cache', None)
         try:
             with context("updating", node):
-                result = func(*values)
+                if cache is None:
+                    result = func(*values)
+                else:
+                    result = cache.call(func, values)
         except Exception as exc:
             self.ignore_exception(exc)
             raise exc
@@ -264,7 +694,54 @@ class Facade(_Facade):
             return result
         # Create triplet
         quality = aggregate_qualities(qualities)
-        return triplet(result, max(stamps), quality)
+        return triplet.unchecked(result, max(stamps), quality)
+
+    def _incremental_aggregation(self, node, changed, *nodes):
+        """Contextualize aggregation, using the changed subnodes only."""
+        reduction = node.reduction
+        for index in changed:
+            reduction.update(index, nodes[index])
+        # Forward first exception
+        exception = reduction.exception()
+        if exception is not None:
+            with context("updating", node):
+                raise exception
+        # Run reducer
+        try:
+            with context("updating", node):
+                return reduction.result()
+        except Exception as exc:
+            self.ignore_exception(exc)
+            raise exc
+
+    def _columnar_aggregation(self, node, func, *nodes):
+        """Contextualize aggregation over the columns of the subnodes."""
+        store = node.columns
+        # Forward first exception
+        exception = store.exception()
+        if exception is not None:
+            with context("updating", node):
+                raise exception
+        # Shortcut for empty nodes
+        if not store.present.all():
+            return
+        stamp = store.stamps.max()
+        # Invalid quality
+        if (store.qualities == int(INVALID)).any():
+            return triplet.unchecked(None, stamp, INVALID)
+        # Run function
+        try:
+            with context("updating", node):
+                result = func(store.view(store.values))
+        except Exception as exc:
+            self.ignore_exception(exc)
+            raise exc
+        # Return triplet
+        if isinstance(result, triplet):
+            return result
+        # Create triplet
+        quality = aggregate_quality_array(store.qualities)
+        return triplet.unchecked(result, stamp, quality)
 
     def _custom_aggregation(self, node, func, *nodes):
         """Contextualize aggregation."""
@@ -315,32 +792,203 @@ class Facade(_Facade):
             self.register_exception(exc)
 
     def _push_event_for_node(self, node):
-        attr = getattr(self, node.name)
+        exception = node.exception()
+        result = node.result() if exception is None else None
+        # Asynchronous push
+        if self._push_queue is not None:
+            item = exception, result, default_timer()
+            self._push_queue.put(node.name, item)
+            return
+        self._push_event(node.name, exception, result)
+
+    def _push_event(self, name, exception, result):
+        attr = getattr(self, name)
         # Exception
-        if node.exception() is not None:
-            exception = to_dev_failed(node.exception())
-            self.push_change_event(node.name, exception)
-            self.push_archive_event(node.name, exception)
+        if exception is not None:
+            exception = to_dev_failed(exception)
+            self.push_change_event(name, exception)
+            self.push_archive_event(name, exception)
             # Log the pushing of exceptions
             msg = 'Pushing an exception for attribute {}'
-            self.debug_exception(exception, msg.format(node.name))
+            self.debug_exception(exception, msg.format(name))
         # Empty result
-        elif node.result() is None:
+        elif result is None:
             pass
         # Triplet result
         else:
-            value, stamp, quality = node.result()
+            value, stamp, quality = result
             if value is None:
                 value = self._get_default_value(attr)
-            self.push_change_event(node.name, value, stamp, quality)
-            self.push_archive_event(node.name, value, stamp, quality)
+            self.push_change_event(name, value, stamp, quality)
+            self.push_archive_event(name, value, stamp, quality)
+
+    # Push queue
+
+    def _start_push_queue(self):
+        if self._push_queue is None:
+            return
+        thread = threading.Thread(
+            target=self._process_push_queue, args=(self._push_queue,))
+        thread.daemon = True
+        thread.start()
+
+    def _process_push_queue(self, queue):
+        while True:
+            batch = queue.get_batch()
+            if batch is None:
+                return
+            for name, (exception, result, queued) in batch:
+                # The device has been deleted in the meantime
+                if queue is not self._push_queue:
+                    return
+                try:
+                    self._push_event(name, exception, result)
+                except Exception as exc:
+                    msg = "Exception while pushing events for {}"
+                    self.ignore_exception(exc, msg.format(name))
+                # Latency
+                latency = default_timer() - queued
+                self._push_stats['pushed'] += 1
+                self._push_stats['latency'] += latency
+                self._push_stats['max_latency'] = max(
+                    self._push_stats['max_latency'], latency)
+
+    def _stop_push_queue(self):
+        queue, self._push_queue = self._push_queue, None
+        if queue is not None:
+            queue.close()
+
+    # Information
+
+    def get_extra_info(self):
+        sections = super(Facade, self).get_extra_info()
+        graph = self._graph or {}
+        # Rule caches
+        caches = [
+            (name, node.cache) for name, node in sorted(graph.items())
+            if getattr(node, 'cache', None) is not None]
+        if caches:
+            lines = ["Rule cache statistics:"]
+            for name, cache in caches:
+                msg = " - {}: {} hit(s), {} miss(es) ({:.1f}% hit rate)"
+                lines.append(msg.format(
+                    name, cache.hits, cache.misses, 100 * cache.hit_rate))
+            sections.append(lines)
+        # Suppressed updates (deadbands and rate limiting)
+        counters = [
+            (name, node.counters) for name, node in sorted(graph.items())
+            if node.counters]
+        if counters:
+            lines = ["Suppressed updates:"]
+            for name, counter in counters:
+                details = ', '.join(
+                    '{} {}'.format(count, key)
+                    for key, count in sorted(counter.items()))
+                lines.append(" - {}: {}".format(name, details))
+            sections.append(lines)
+        # Background subscriptions
+        status = getattr(self, '_subscription_status', None)
+        if status:
+            with self._subscription_lock:
+                items = list(status.items())
+            lines = ["Pending subscriptions:"]
+            for attr, value in items:
+                lines.append(" - {}: {}".format(attr, value))
+            sections.append(lines)
+        # Event queue
+        queue = getattr(self, '_event_queue', None)
+        if queue is not None:
+            lines = ["Event queue statistics:"]
+            msg = " - depth: {} (peak {}, limit {}), {} shed"
+            lines.append(msg.format(
+                len(queue), queue.max_depth, queue.maxsize, queue.shed()))
+            details = ', '.join(
+                '{} {}'.format(queue.counters[key], key) for key in (
+                    'batches', 'conflated', 'overflow', 'shed', 'overloads'))
+            lines.append(" - events: {}".format(details))
+            sections.append(lines)
+        # Overload episodes
+        episodes = list(queue.episodes) if queue is not None else []
+        if queue is not None and queue.episode is not None:
+            episodes.append(queue.episode)
+        if episodes:
+            lines = ["Overload episodes:"]
+            for episode in episodes:
+                duration = episode['duration']
+                duration = "ongoing" if duration is None else \
+                    "{:.3f} s".format(duration)
+                msg = " - {}: {}, peak depth {}, {} shed event(s)"
+                lines.append(msg.format(
+                    time.ctime(episode['start']), duration,
+                    episode['peak'], episode['shed']))
+            sections.append(lines)
+        # Push queue
+        queue = getattr(self, '_push_queue', None)
+        if queue is not None:
+            stats = self._push_stats
+            average = stats['latency'] / max(stats['pushed'], 1)
+            lines = ["Event push statistics:"]
+            lines.append(" - depth: {} (peak {})".format(
+                len(queue), queue.max_depth))
+            lines.append(" - events: {} pushed, {} conflated".format(
+                stats['pushed'], queue.counters['conflated']))
+            msg = " - latency: {:.3f} ms average, {:.3f} ms max"
+            lines.append(msg.format(
+                1000 * average, 1000 * stats['max_latency']))
+            sections.append(lines)
+        # Remote cache
+        if getattr(self, '_remote_cache', None) is not None:
+            lines = ["Remote cache ({}):".format(self._remote_cache.path)]
+            details = ', '.join(
+                '{} {}'.format(count, key) for key, count in
+                sorted(self._remote_cache_stats.items()))
+            lines.append(" - {}".format(details or "not used"))
+            sections.append(lines)
+        return sections
+
+    def get_profile(self):
+        """Return the execution statistics of the graph nodes."""
+        graph = self._graph or {}
+        profiling = self._graph is not None and self._graph.profiling
+        profile = self._graph.profile() if profiling else {}
+        nodes = {}
+        for name, node in graph.items():
+            stats = profile.get(name, {})
+            if node.counters:
+                stats['counters'] = dict(node.counters)
+            cache = getattr(node, 'cache', None)
+            if cache is not None:
+                stats['cache'] = {
+                    'hits': cache.hits, 'misses': cache.misses}
+            if stats:
+                nodes[name] = stats
+        return {'enabled': profiling, 'nodes': nodes}
+
+    @command(
+        dtype_out=str,
+        doc_out="Execution statistics of the rules (JSON).",
+        display_level=DispLevel.EXPERT)
+    def GetProfile(self):
+        return json.dumps(self.get_profile(), sort_keys=True)
 
     # Clean up
 
     def delete_device(self):
+        # Ignore the pending checks of cached results
+        self._validation_token = None
+        # Stop the background subscriptions and the event queue
+        if getattr(self, '_subscription_lock', None) is not None:
+            self._stop_subscriptions()
+        if getattr(self, '_event_queue', None) is not None:
+            self._stop_event_queue()
+        if getattr(self, '_push_queue', None) is not None:
+            self._stop_push_queue()
         # Reset graph
         try:
             self._graph.reset()
+            # Stop the graph executor
+            if self._graph.executor is not None:
+                self._graph.executor.shutdown(wait=False)
         except Exception as exc:
             msg = "Error while resetting the graph"
             self.ignore_exception(exc, msg)
@@ -358,6 +1006,9 @@ class TimedFacade(Facade):
     - the `UpdateTime` polled command, used trigger updates periodically
     - the `Time` local attribute, a float updated at every tick
     - the `on_time` method, a callback that runs at every tick
+
+    The nodes updated in `on_time` are propagated together with the `Time`
+    attribute, in a single transaction.
     """
 
     def init_device(self):
@@ -378,5 +1029,6 @@ class TimedFacade(Facade):
         display_level=DispLevel.EXPERT)
     def UpdateTime(self):
         t = time.time()
-        result = triplet(t, t)
-        self.graph['Time'].set_result(result)
+        result = triplet.unchecked(t, t)
+        with self.graph.transaction():
+            self.graph['Time'].set_result(result)
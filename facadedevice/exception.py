@@ -49,6 +49,34 @@ def to_dev_failed(exc):
         return exc
 
 
+# Exception equivalence
+
+def exception_key(exc):
+    """Return a comparable key, ignoring the tracebacks."""
+    # DevFailed errors
+    if isinstance(exc, DevFailed):
+        return DevFailed, tuple(
+            (error.reason, error.desc, error.origin) for error in exc.args)
+    # Context exception
+    if isinstance(exc, ContextException):
+        return (ContextException, exc.context, repr(exc.origin),
+                exception_key(exc.base))
+    # Other exceptions
+    return type(exc), exc.args
+
+
+def equivalent_exceptions(exc1, exc2):
+    """Check whether two exceptions are equivalent."""
+    if exc1 is exc2:
+        return True
+    if exc1 is None or exc2 is None:
+        return False
+    try:
+        return bool(exception_key(exc1) == exception_key(exc2))
+    except Exception:
+        return False
+
+
 # Exception context
 
 class ContextException(Exception):
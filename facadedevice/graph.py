@@ -3,12 +3,21 @@
 # Imports
 
 import time
+import zlib
+import heapq
 import warnings
+import itertools
+import threading
 from functools import partial
-from collections import Mapping, namedtuple, defaultdict
+from operator import itemgetter
+from timeit import default_timer
+from contextlib import contextmanager
+from collections import Mapping, OrderedDict, Counter, deque
 
 
+import numpy
 from tango import AttrQuality
+from facadedevice.exception import equivalent_exceptions
 from numpy.version import version as numpy_version
 
 
@@ -39,80 +48,287 @@ array_equal = check_numpy_version()
 VALID = AttrQuality.ATTR_VALID
 INVALID = AttrQuality.ATTR_INVALID
 
+# Comparison strategies
+ALWAYS = 'always'
+IDENTITY = 'identity'
+HASH = 'hash'
+DEEP = 'deep'
+STRATEGIES = ALWAYS, IDENTITY, HASH, DEEP
+
 
 # Triplet object
 
-triplet = namedtuple("triplet", ("value", "stamp", "quality"))
+_tuple_new = tuple.__new__
+_scalar_types = bool, int, float, str
 
 
-def new_triplet(cls, value, stamp=None, quality=VALID):
-    if isinstance(value, triplet):
-        raise TypeError("The value cannot be a triplet")
-    if stamp is None:
-        stamp = time.time()
-    if not isinstance(stamp, float):
-        raise TypeError("The timestamp is not a float")
-    if not isinstance(quality, int):
-        raise TypeError("The quality is not a integer")
-    if value is None or quality == INVALID:
-        value, quality = None, INVALID
-    return cls.__rawnew__(cls, value, stamp, quality)
+class triplet(tuple):
+    """Immutable (value, stamp, quality) tuple holding a node result.
 
+    The constructor checks its arguments, and is meant for user code.
+    The internal paths use `triplet.unchecked` instead. The namedtuple
+    interface (`_fields`, `_make`, `_asdict` and `_replace`) is kept.
+    """
 
-def compare_triplet(a, b):
-    assert isinstance(a, triplet)
-    try:
-        value, stamp, quality = b
-    except:
-        return False
-    return (a.stamp == stamp and
-            a.quality == quality and
-            array_equal(a.value, value))
+    __slots__ = ()
+    _fields = ("value", "stamp", "quality")
+
+    def __new__(cls, value, stamp=None, quality=VALID):
+        if isinstance(value, triplet):
+            raise TypeError("The value cannot be a triplet")
+        if stamp is None:
+            stamp = time.time()
+        if not isinstance(stamp, float):
+            raise TypeError("The timestamp is not a float")
+        if not isinstance(quality, int):
+            raise TypeError("The quality is not a integer")
+        if value is None or quality == INVALID:
+            value, quality = None, INVALID
+        return _tuple_new(cls, (value, stamp, quality))
+
+    @classmethod
+    def unchecked(cls, value, stamp, quality=VALID):
+        """Fast constructor for trusted arguments (no type checks)."""
+        if value is None or quality == INVALID:
+            return _tuple_new(cls, (None, stamp, INVALID))
+        return _tuple_new(cls, (value, stamp, quality))
+
+    @classmethod
+    def from_attr_value(cls, attr_value):
+        return cls.unchecked(
+            attr_value.value, attr_value.time.totime(), attr_value.quality)
+
+    @staticmethod
+    def __rawnew__(cls, value, stamp, quality):
+        return _tuple_new(cls, (value, stamp, quality))
+
+    # Fields
+
+    value = property(itemgetter(0))
+    stamp = property(itemgetter(1))
+    quality = property(itemgetter(2))
+
+    # Namedtuple interface
+
+    @classmethod
+    def _make(cls, iterable):
+        result = _tuple_new(cls, iterable)
+        if len(result) != 3:
+            message = "Expected 3 arguments, got {}"
+            raise TypeError(message.format(len(result)))
+        return result
+
+    def _asdict(self):
+        return OrderedDict(zip(self._fields, self))
+
+    def _replace(self, **kwargs):
+        result = self._make(map(kwargs.pop, self._fields, self))
+        if kwargs:
+            message = "Got unexpected field names: {!r}"
+            raise ValueError(message.format(list(kwargs)))
+        return result
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    def __repr__(self):
+        return "triplet(value={!r}, stamp={!r}, quality={!r})".format(*self)
+
+    # Comparison
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        try:
+            value, stamp, quality = other
+        except Exception:
+            return False
+        if not (self[1] == stamp and self[2] == quality):
+            return False
+        current = self[0]
+        if current is value:
+            return True
+        # Shortcut for scalars
+        if type(current) in _scalar_types and type(value) is type(current):
+            return current == value
+        return array_equal(current, value)
 
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
-def from_attr_value(cls, attr_value):
-    return cls(attr_value.value, attr_value.time.totime(), attr_value.quality)
+    __hash__ = tuple.__hash__
 
 
-triplet.__rawnew__ = staticmethod(triplet.__new__)
-triplet.__new__ = staticmethod(new_triplet)
-triplet.__eq__ = compare_triplet
-triplet.__ne__ = lambda self, arg: not self.__eq__(arg)
-triplet.from_attr_value = classmethod(from_attr_value)
+# Bitmask helper
+
+def iter_bits(mask):
+    while mask:
+        bit = mask & -mask
+        yield bit.bit_length() - 1
+        mask ^= bit
+
+
+# Content hash
+
+def content_hash(value):
+    """Return a cheap digest of a value, or None if it can't be hashed.
+
+    Hashable values are kept as they are (hash collisions like
+    hash(-1) == hash(-2) would hide changes), other values are hashed
+    as numpy arrays.
+    """
+    if not isinstance(value, numpy.ndarray):
+        try:
+            hash(value)
+            return type(value), value
+        except TypeError:
+            value = numpy.asarray(value)
+    if value.dtype.hasobject:
+        return None
+    data = numpy.ascontiguousarray(value).view(numpy.uint8)
+    return value.dtype.str, value.shape, zlib.crc32(data)
 
 
 # Node object
 
 class Node(object):
+    """Hold a result or an exception, and notify the callbacks on change.
+
+    The comparison strategy decides whether a new result is a change:
+
+    - `'deep'`: compare the whole values (default)
+    - `'hash'`: compare CRC32 digests of the numpy arrays (other values
+      are compared by equality)
+    - `'identity'`: compare the value objects identities
+    - `'always'`: always notify
+
+    Stamps and qualities are always compared. The version is incremented
+    every time the node notifies a change.
+
+    The digests are only computed when the stamps and qualities match. The
+    digest of the new array is then kept for the next comparison, but the
+    current array has to be hashed too if its digest is not known yet
+    (e.g. its stamp differed from the previous one). Hashing costs more
+    than a deep comparison, so 'hash' is not a speed-up: it compares the
+    arrays bitwise instead (e.g. the same NaN values are not a change).
 
-    def __init__(self, name, description=None, callbacks=()):
+    Exceptions are compared by type and arguments (reason, description
+    and origin for DevFailed), so the duplicates of the current exception
+    are ignored and counted.
+
+    Absolute and relative (in percent) deadbands can also be set for
+    numerical values. A new result within the deadbands of the last notified
+    one (for all elements, with the same quality) is stored, but nothing is
+    notified.
+    """
+
+    def __init__(self, name, description=None, callbacks=(), compare=DEEP,
+                 abs_change=None, rel_change=None):
+        if compare not in STRATEGIES:
+            raise ValueError('Not a valid comparison strategy')
         self._result = None
         self._exception = None
+        self._digest = None
+        self._notified = None
         self.name = name
+        self.version = 0
+        self.compare = compare
+        self.abs_change = None if abs_change is None else float(abs_change)
+        self.rel_change = None if rel_change is None else float(rel_change)
+        self.counters = Counter()
         self.description = description or name
         self.callbacks = list(callbacks)
 
     # Setters
 
     def set_result(self, result):
+        # Keep the result without notifying
+        if self._within_deadband(result):
+            self.counters['deadband'] += 1
+            self._result, self._digest = result, None
+            return
         diff = (
-            self._exception is not None or
-            self._result != result)
+            self._differs(result) or
+            self._exception is not None)
         self._result = result
         self._exception = None
         if diff:
+            self._notified = result
+            self.version += 1
             self.notify()
 
     def set_exception(self, exception):
         if not isinstance(exception, BaseException):
             raise TypeError('Not a valid exception')
-        diff = (
-            self._result is not None or
-            self._exception != exception)
+        # Ignore the duplicates of the current exception
+        if self._result is None and \
+           equivalent_exceptions(self._exception, exception):
+            if self._exception is not exception:
+                self.counters['duplicate_exceptions'] += 1
+            return
         self._result = None
         self._exception = exception
-        if diff:
-            self.notify()
+        self._notified = None
+        self.version += 1
+        self.notify()
+
+    def _within_deadband(self, result):
+        if self.abs_change is None and self.rel_change is None:
+            return False
+        old = self._notified
+        if self._exception is not None or old is None or result is None:
+            return False
+        # Compare metadata
+        if isinstance(old, triplet) and isinstance(result, triplet):
+            if old.quality != result.quality:
+                return False
+            old, result = old.value, result.value
+        # Compare numerical values
+        old, new = numpy.asarray(old), numpy.asarray(result)
+        if old.shape != new.shape:
+            return False
+        if old.dtype.kind not in 'biuf' or new.dtype.kind not in 'biuf':
+            return False
+        old = old.astype(float)
+        delta = numpy.abs(new - old)
+        # NaN values are never within the deadbands
+        if self.abs_change is not None:
+            if not (delta < self.abs_change).all():
+                return False
+        if self.rel_change is not None:
+            if not (delta < numpy.abs(old) * self.rel_change / 100).all():
+                return False
+        return True
+
+    def _differs(self, result):
+        old = self._result
+        if self.compare == DEEP:
+            return old != result
+        # The digest is only valid for the current result
+        digest, self._digest = self._digest, None
+        if self.compare == ALWAYS:
+            return True
+        if old is result:
+            return False
+        if old is None or result is None:
+            return True
+        # Compare metadata first
+        if isinstance(old, triplet) and isinstance(result, triplet):
+            if old.stamp != result.stamp or old.quality != result.quality:
+                return True
+            old, result = old.value, result.value
+        # Compare identities
+        if self.compare == IDENTITY:
+            return old is not result
+        # Compare the non-array values by equality
+        if not isinstance(old, numpy.ndarray) or \
+           not isinstance(result, numpy.ndarray):
+            return type(old) is not type(result) or bool(old != result)
+        # Compare digests, computed once the metadata match
+        if digest is None:
+            digest = content_hash(old)
+        self._digest = content_hash(result)
+        return digest is None or digest != self._digest
 
     # Getters
 
@@ -150,21 +366,262 @@ class RestrictedNode(Node):
         return super(RestrictedNode, self).set_result(result)
 
 
+# Columnar storage
+
+class Columns(object):
+    """Preallocated numpy columns holding the results of indexed nodes.
+
+    The value dtype is set by the first value, and upcast if needed
+    (to object for non-scalar or incompatible values). An upcast replaces
+    the values array, so the views returned before it are not updated
+    anymore. The value of an entry without value (e.g. invalid quality) is
+    reset to zero, or None for the object dtype.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.values = numpy.zeros(size)
+        self.stamps = numpy.zeros(size)
+        self.qualities = numpy.full(size, int(VALID), dtype=int)
+        self.present = numpy.zeros(size, dtype=bool)
+        self.errors = {}
+        self._typed = False
+
+    def update(self, index, node):
+        exception = node.exception()
+        result = None if exception is not None else node.result()
+        # Exception or empty node
+        self.errors.pop(index, None)
+        if result is None:
+            if exception is not None:
+                self.errors[index] = exception
+            self.present[index] = False
+            return
+        # Set result
+        value, stamp, quality = result
+        self.present[index] = True
+        self.stamps[index] = stamp
+        self.qualities[index] = int(quality)
+        if value is None:
+            self._reset_value(index)
+        else:
+            self._set_value(index, value)
+
+    def _reset_value(self, index):
+        dtype = self.values.dtype
+        empty = None if dtype.hasobject else numpy.zeros((), dtype)
+        self.values[index] = empty
+
+    def _set_value(self, index, value):
+        dtype = numpy.dtype(object)
+        if numpy.ndim(value) == 0:
+            dtype = numpy.asarray(value).dtype
+        if not self._typed:
+            self.values = numpy.zeros(self.size, dtype)
+            self._typed = True
+        elif dtype != self.values.dtype:
+            try:
+                dtype = numpy.result_type(self.values.dtype, dtype)
+            except TypeError:
+                dtype = numpy.dtype(object)
+            if dtype != self.values.dtype:
+                self.values = self.values.astype(dtype)
+        self.values[index] = value
+
+    def exception(self):
+        if not self.errors:
+            return None
+        return self.errors[min(self.errors)]
+
+    @staticmethod
+    def view(array):
+        """Return a read-only view of a column."""
+        view = array.view()
+        view.flags.writeable = False
+        return view
+
+
+# Column node
+
+class ColumnNode(RestrictedNode):
+    """Restricted node also storing its result in shared columns."""
+
+    def __init__(self, name, columns, index, **kwargs):
+        super(ColumnNode, self).__init__(name, **kwargs)
+        self.columns = columns
+        self.index = index
+
+    def notify(self):
+        self.columns.update(self.index, self)
+        super(ColumnNode, self).notify()
+
+
+# Rule cache
+
+class RuleCache(object):
+    """Remember the result of a pure rule for given input values.
+
+    The last input values are always remembered. If size is positive,
+    a bounded LRU cache is also used for hashable input values.
+    """
+
+    def __init__(self, size=0):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._last = None
+        self._lru = OrderedDict()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / float(total) if total else 0.
+
+    def _same_as_last(self, values):
+        if self._last is None:
+            return False
+        last, _ = self._last
+        return len(last) == len(values) and all(
+            a is b or array_equal(a, b) for a, b in zip(last, values))
+
+    def call(self, func, values):
+        values = tuple(values)
+        # Same values as last call
+        if self._same_as_last(values):
+            self.hits += 1
+            return self._last[1]
+        # Get LRU key (only for hashable values)
+        key = None
+        if self.size > 0:
+            try:
+                hash(values)
+            except TypeError:
+                pass
+            else:
+                key = values
+        # LRU hit
+        if key is not None and key in self._lru:
+            self.hits += 1
+            result = self._lru.pop(key)
+            self._lru[key] = result
+            self._last = values, result
+            return result
+        # Miss
+        self.misses += 1
+        result = func(*values)
+        self._last = values, result
+        if key is not None:
+            self._lru[key] = result
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
+        return result
+
+    def clear(self):
+        self._last = None
+        self._lru.clear()
+
+
+# Rule profile
+
+class RuleProfile(object):
+    """Execution statistics of a rule (times in seconds)."""
+
+    __slots__ = (
+        'calls', 'rule_time', 'max_rule_time', 'notify_time', 'waves',
+        '_wave')
+
+    def __init__(self):
+        self.calls = 0
+        self.rule_time = 0.
+        self.max_rule_time = 0.
+        self.notify_time = 0.
+        self.waves = 0
+        self._wave = None
+
+    def add_call(self, duration, wave):
+        self.calls += 1
+        self.rule_time += duration
+        self.max_rule_time = max(self.max_rule_time, duration)
+        if wave != self._wave:
+            self._wave = wave
+            self.waves += 1
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'rule_time': self.rule_time,
+            'max_rule_time': self.max_rule_time,
+            'notify_time': self.notify_time,
+            'waves': self.waves}
+
+
 # Graph object
 
 class Graph(Mapping):
+    """Reactive graph of nodes.
 
-    def __init__(self):
+    An executor (e.g. a thread pool) can be provided to evaluate the
+    independent nodes of the same topological rank in parallel. Results
+    are still applied and notified in a deterministic order.
+
+    Lazy rules are not computed during propagation unless their node is
+    observed (see `observe`). They are marked dirty instead, and computed
+    on demand by `evaluate` or by a subscriber that gets updated.
+
+    Rules can be rate limited with a minimum interval (in seconds). The
+    updates received in between are coalesced, and a trailing update
+    computes the node with the latest inputs once the interval is over.
+    It runs from a timer thread, under the context manager returned by
+    `timer_lock` if provided (e.g. the lock protecting the graph).
+
+    Delta rules take the sorted positions of the publishers that changed
+    since their last computation as first argument, followed by the
+    publishers. All the positions are given if the changes are unknown.
+
+    If profiling is enabled, the number of calls, the rule and notify
+    times, and the number of propagation waves are recorded for each
+    computed node (see `profile`).
+    """
+
+    def __init__(self, executor=None, profiling=False, timer_lock=None):
+        # Options
+        self.executor = executor
+        self.profiling = profiling
+        self.timer_lock = timer_lock
+        self.clock = default_timer
         # Graph state
         self._nodes = {}
         self._rules = {}
-        # Computed state
+        self._lazy = set()
+        self._observers = {}
+        self._intervals = {}
+        self._delta = set()
+        self._built = False
+        # Dense node indexes
+        self._ids = {}
+        self._table = []
+        self._free = []
+        # Computed state (subscriptions are bitmasks of node indexes)
+        self._ranks = {}
+        self._dirty = set()
         self._updates = {}
-        self._dependencies = defaultdict(set)
-        self._subscriptions = defaultdict(set)
-        # Propagation state
-        self._pending = set()
+        self._subscriptions = []
+        # Delta state (positions of the changed publishers)
+        self._positions = {}
+        self._changed = {}
+        self._delta_mask = 0
+        # Rate limiting state
+        self._timestamps = {}
+        self._timers = {}
+        # Profiling state
+        self._profiles = {}
+        self._wave = 0
+        # Propagation state (pending is a bitmask of node indexes)
+        self._queue = []
+        self._pending = 0
         self._propagating = False
+        self._transactions = 0
+        self._sequence = itertools.count()
 
     # Accessors
 
@@ -175,6 +632,26 @@ class Graph(Mapping):
         _, bind = self._rules[node]
         return [self._nodes[subname] for subname in bind]
 
+    def subscribers(self, name):
+        node = self._nodes[name]
+        return self._subscribers(node)
+
+    def rank(self, name):
+        """Return the rank of a node (0 for the nodes without rule)."""
+        return self._ranks.get(self._nodes[name], 0)
+
+    def profile(self):
+        """Return the execution statistics of the computed nodes.
+
+        It produces a dictionnary of <node_name, statistics>.
+        """
+        return {
+            node.name: profile.as_dict()
+            for node, profile in list(self._profiles.items())}
+
+    def reset_profile(self):
+        self._profiles = {}
+
     # Create graph
 
     def add_node(self, node):
@@ -182,15 +659,213 @@ class Graph(Mapping):
             message = "A node called {} already exists"
             raise ValueError(message.format(node.name))
         self._nodes[node.name] = node
+        # Set index
+        if self._free:
+            index = self._free.pop()
+        else:
+            index = len(self._table)
+            self._table.append(None)
+            self._subscriptions.append(0)
+        self._ids[node] = index
+        self._table[index] = node
 
-    def add_rule(self, node, func, bind):
-        if node not in self._nodes.values():
+    def add_rule(self, node, func, bind, lazy=False, min_interval=None,
+                 delta=False):
+        if self._nodes.get(node.name) is not node:
             message = "The node {!r} is not in the graph"
             raise ValueError(message.format(node))
         if node in self._rules:
             message = "A rule for {} already exists"
             raise ValueError(message.format(node.name))
+        if min_interval is not None and min_interval < 0:
+            message = "Invalid minimum interval for {}: {}"
+            raise ValueError(message.format(node.name, min_interval))
+        if not self._built:
+            self._rules[node] = func, bind
+            if lazy:
+                self._lazy.add(node)
+            if min_interval:
+                self._intervals[node] = min_interval
+            if delta:
+                self._delta.add(node)
+            return
+        # Incremental update
+        self._check_mutable()
+        for name in bind:
+            if name not in self._nodes:
+                message = "The node {!r} is not in the graph"
+                raise ValueError(message.format(name))
+        publishers = [self._nodes[name] for name in bind]
+        # Check cyclic dependencies
+        downstream = self._downstream(node)
+        for publisher in publishers:
+            if publisher is node or publisher in downstream:
+                path = self._downstream_path(node, publisher) + [node]
+                path = ' -> '.join(current.name for current in path)
+                msg = '{} is involved in a cyclic dependency: {}'
+                raise ValueError(msg.format(node, path))
+        # Set rule, update callback and subscriptions
         self._rules[node] = func, bind
+        if lazy:
+            self._lazy.add(node)
+        if min_interval:
+            self._intervals[node] = min_interval
+        if delta:
+            self._delta.add(node)
+        self._set_update(node, func, publishers)
+        for publisher in publishers:
+            self._subscribe(publisher, node)
+        # Update the ranks of the affected subgraph
+        self._rerank([node] + sorted(downstream, key=self._ranks.get))
+        # Compute the new node
+        self.schedule(node)
+        if not self._transactions:
+            self.propagate()
+
+    def remove_node(self, node):
+        if self._nodes.get(node.name) is not node:
+            message = "The node {!r} is not in the graph"
+            raise ValueError(message.format(node))
+        # Check subscribers
+        if self._built:
+            subscribers = self._subscribers(node)
+        else:
+            subscribers = [
+                subscriber for subscriber, (_, bind) in self._rules.items()
+                if node.name in bind]
+        if subscribers:
+            message = "The node {} is bound to {}"
+            names = ', '.join(sorted(current.name for current in subscribers))
+            raise ValueError(message.format(node.name, names))
+        # Remove rule and node
+        if node in self._rules:
+            self.remove_rule(node)
+        del self._nodes[node.name]
+        # Free index
+        index = self._ids.pop(node)
+        self._table[index] = None
+        self._free.append(index)
+
+    def remove_rule(self, node):
+        if node not in self._rules:
+            message = "There is no rule for {!r}"
+            raise ValueError(message.format(node))
+        self._check_mutable()
+        self._lazy.discard(node)
+        self._delta.discard(node)
+        self._intervals.pop(node, None)
+        self._timestamps.pop(node, None)
+        self._profiles.pop(node, None)
+        self._cancel_timer(node)
+        if not self._built:
+            del self._rules[node]
+            return
+        # Incremental update
+        for publisher in self._publishers(node):
+            self._unsubscribe(publisher, node)
+        del self._rules[node]
+        del self._updates[node]
+        del self._ranks[node]
+        self._positions.pop(node, None)
+        self._changed.pop(node, None)
+        self._delta_mask &= ~(1 << self._ids[node])
+        self._dirty.discard(node)
+        self._pending &= ~(1 << self._ids[node])
+
+    # Lazy evaluation
+
+    def observe(self, node, predicate=None):
+        """Compute the given lazy node during propagation.
+
+        If a predicate is given, the node is only considered as observed
+        when the predicate returns True.
+        """
+        self._observers[node] = predicate
+
+    def unobserve(self, node):
+        self._observers.pop(node, None)
+
+    def _observed(self, node):
+        if node not in self._observers:
+            return False
+        predicate = self._observers[node]
+        return predicate is None or bool(predicate())
+
+    def evaluate(self, node):
+        """Compute the given node and its ancestors if they are dirty."""
+        if node not in self._dirty:
+            return
+        # Collect the dirty ancestors
+        dirty, stack = set(), [node]
+        while stack:
+            current = stack.pop()
+            if current in dirty:
+                continue
+            dirty.add(current)
+            stack.extend(
+                p for p in self._publishers(current) if p in self._dirty)
+        # Compute them in topological order
+        with self.transaction():
+            for current in sorted(dirty, key=self._ranks.get):
+                self._dirty.discard(current)
+                self._update(current)
+            # Don't compute them again in the next wave
+            for current in dirty:
+                self._pending &= ~(1 << self._ids[current])
+
+    # Incremental helpers
+
+    def _check_mutable(self):
+        if self._propagating:
+            raise RuntimeError("The graph cannot change during propagation")
+
+    def _subscribe(self, publisher, subscriber):
+        index = self._ids[publisher]
+        self._subscriptions[index] |= 1 << self._ids[subscriber]
+        if self.callback not in publisher.callbacks:
+            publisher.callbacks.append(self.callback)
+
+    def _unsubscribe(self, publisher, subscriber):
+        index = self._ids[publisher]
+        self._subscriptions[index] &= ~(1 << self._ids[subscriber])
+        if self._subscriptions[index]:
+            return
+        if self.callback in publisher.callbacks:
+            publisher.callbacks.remove(self.callback)
+
+    def _subscribers(self, node):
+        mask = self._subscriptions[self._ids[node]]
+        return [self._table[index] for index in iter_bits(mask)]
+
+    def _downstream(self, node):
+        result = set()
+        queue = deque([node])
+        while queue:
+            for subscriber in self._subscribers(queue.popleft()):
+                if subscriber not in result:
+                    result.add(subscriber)
+                    queue.append(subscriber)
+        return result
+
+    def _downstream_path(self, start, stop):
+        parents = {start: None}
+        queue = deque([start])
+        while stop not in parents:
+            current = queue.popleft()
+            for subscriber in self._subscribers(current):
+                if subscriber not in parents:
+                    parents[subscriber] = current
+                    queue.append(subscriber)
+        path = [stop]
+        while parents[path[-1]] is not None:
+            path.append(parents[path[-1]])
+        return path[::-1]
+
+    def _rerank(self, nodes):
+        """Recompute the rank of nodes given in topological order."""
+        for node in nodes:
+            ranks = [self._ranks.get(p, 0) for p in self._publishers(node)]
+            self._ranks[node] = 1 + max(ranks or [0])
 
     # Build dependencies
 
@@ -199,82 +874,355 @@ class Graph(Mapping):
         for node, (func, bind) in self._rules.items():
             # Set update callbacks
             publishers = [self._nodes[subname] for subname in bind]
-            self._updates[node] = partial(func, *publishers)
+            self._set_update(node, func, publishers)
             # Set subscriptions
+            bit = 1 << self._ids[node]
             for publisher in publishers:
-                self._subscriptions[publisher].add(node)
-            # Compute dependencies
-            seen = set()
-            names = set(bind)
-            while names:
-                current_name = names.pop()
-                seen.add(current_name)
-                current_node = self._nodes[current_name]
-                if current_node not in self._rules:
-                    continue
-                current_rule = self._rules[current_node]
-                names |= set(current_rule[1]) - seen
-            # Check cyclic dependencies
-            if node.name in seen:
-                msg = '{} is involved in a cyclic dependency'
-                raise ValueError(msg.format(node))
-            # Set dependencies
-            self._dependencies[node] = {self._nodes[name] for name in seen}
+                self._subscriptions[self._ids[publisher]] |= bit
+        # Compute ranks (and check cyclic dependencies)
+        self._rerank(self._sort())
+        # Lazy nodes are not computed yet
+        self._dirty = set(self._lazy)
         # Set callbacks (after the graph is proven to be valid)
-        for publisher in self._subscriptions.keys():
+        for publisher in self._publishing():
             if self.callback not in publisher.callbacks:
                 publisher.callbacks.append(self.callback)
+        self._built = True
+
+    def _set_update(self, node, func, publishers):
+        if node not in self._delta:
+            self._updates[node] = partial(func, *publishers)
+            return
+        # Delta rule
+        positions = {}
+        for position, publisher in enumerate(publishers):
+            positions.setdefault(publisher, []).append(position)
+        self._positions[node] = positions
+        self._delta_mask |= 1 << self._ids[node]
+        self._updates[node] = partial(
+            self._delta_update, node, func, publishers)
+
+    def _delta_update(self, node, func, publishers):
+        changed = self._changed.pop(node, None)
+        if changed is None:
+            changed = range(len(publishers))
+        return func(sorted(changed), *publishers)
+
+    def _publishing(self):
+        return [
+            self._table[index]
+            for index, mask in enumerate(self._subscriptions) if mask]
+
+    def _publishers(self, node):
+        if node not in self._rules:
+            return []
+        _, bind = self._rules[node]
+        return [self._nodes[name] for name in bind]
+
+    def _sort(self):
+        """Return the rule nodes in topological order.
+
+        Use an iterative version of Tarjan's algorithm, so a node always
+        comes after its publishers. A ValueError is raised if a strongly
+        connected component reveals a cyclic dependency.
+        """
+        order = []
+        stack = []
+        indexes = {}
+        lowlinks = {}
+        counter = itertools.count()
+        for root in self._rules:
+            if root in indexes:
+                continue
+            indexes[root] = lowlinks[root] = next(counter)
+            stack.append(root)
+            work = [(root, iter(self._publishers(root)))]
+            while work:
+                node, publishers = work[-1]
+                # Visit the next publisher
+                for publisher in publishers:
+                    if publisher not in indexes:
+                        indexes[publisher] = next(counter)
+                        lowlinks[publisher] = indexes[publisher]
+                        stack.append(publisher)
+                        work.append(
+                            (publisher, iter(self._publishers(publisher))))
+                        break
+                    if publisher in lowlinks:
+                        lowlinks[node] = min(
+                            lowlinks[node], indexes[publisher])
+                # All publishers visited
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlinks[parent] = min(
+                            lowlinks[parent], lowlinks[node])
+                    if lowlinks[node] != indexes[node]:
+                        continue
+                    # Pop the strongly connected component
+                    component = set()
+                    while node not in component:
+                        component.add(stack.pop())
+                    for current in component:
+                        del lowlinks[current]
+                    # Check cyclic dependencies
+                    if len(component) > 1 or \
+                       node in self._publishers(node):
+                        path = ' -> '.join(
+                            current.name
+                            for current in self._cycle(node, component))
+                        msg = '{} is involved in a cyclic dependency: {}'
+                        raise ValueError(msg.format(node, path))
+                    if node in self._rules:
+                        order.append(node)
+        return order
+
+    def _cycle(self, start, component):
+        """Return a cyclic path from start to start within a component."""
+        parents = {}
+        queue = deque([start])
+        while start not in parents:
+            node = queue.popleft()
+            for publisher in self._publishers(node):
+                if publisher in component and publisher not in parents:
+                    parents[publisher] = node
+                    queue.append(publisher)
+        path = [start]
+        while len(path) == 1 or path[-1] is not start:
+            path.append(parents[path[-1]])
+        return path
 
     # Reset
 
     def reset(self):
         # Remove callbacks
-        for publisher in self._subscriptions.keys():
+        for publisher in self._publishing():
             if self.callback in publisher.callbacks:
                 publisher.callbacks.remove(self.callback)
+        # Stop trailing updates
+        for node in list(self._timers):
+            self._cancel_timer(node)
+        self._timestamps = {}
         # Reset computed state
+        self._built = False
+        self._ranks = {}
+        self._dirty = set()
         self._updates = {}
-        self._dependencies = defaultdict(set)
-        self._subscriptions = defaultdict(set)
+        self._subscriptions = [0] * len(self._table)
+        self._positions = {}
+        self._changed = {}
+        self._delta_mask = 0
         # Reset propagation state
-        self._pending = set()
+        self._queue = []
+        self._pending = 0
         self._propagating = False
 
     # Propagation
 
     def callback(self, node):
-        self._pending |= self._subscriptions[node]
-        if not self._propagating:
+        self._schedule_subscribers(node)
+        if not self._propagating and not self._transactions:
             self.propagate()
 
+    def _schedule_subscribers(self, node):
+        # Record the changed positions for delta rules
+        delta = self._subscriptions[self._ids[node]] & self._delta_mask
+        for index in iter_bits(delta):
+            subscriber = self._table[index]
+            changed = self._changed.setdefault(subscriber, set())
+            changed.update(self._positions[subscriber].get(node, ()))
+        # Schedule the subscribers
+        mask = self._subscriptions[self._ids[node]] & ~self._pending
+        self._pending |= mask
+        for index in iter_bits(mask):
+            subscriber = self._table[index]
+            self._push(subscriber, index)
+
+    def schedule(self, node):
+        index = self._ids[node]
+        if self._pending & 1 << index:
+            return
+        self._pending |= 1 << index
+        self._push(node, index)
+
+    def _push(self, node, index):
+        # The sequence number breaks the ties, so nodes are never compared
+        item = self._ranks[node], index, next(self._sequence), node
+        heapq.heappush(self._queue, item)
+
     def propagate(self):
         # Set propagation flag
         try:
             self._propagating = True
-            # Loop over pending updates
-            while self._pending:
-                # Find next item
-                for node in self._pending:
-                    dependencies = self._dependencies[node]
-                    if self._pending.isdisjoint(dependencies):
-                        self._pending.remove(node)
-                        break
-                # Deadlock
-                else:
-                    warnings.warn('Propagation deadlocked')
-                    node = self._pending.pop()
+            self._wave += 1
+            # Loop over pending updates, lowest rank first: all the
+            # dependencies of a node have a lower rank than the node itself
+            while self._queue:
+                nodes = [
+                    node for node in self._pop_rank()
+                    if not self._defer(node) and not self._throttle(node)]
                 # Update and notify
-                self.update(node)
+                if self.executor is None or len(nodes) < 2:
+                    for node in nodes:
+                        self.update(node)
+                else:
+                    self.update_all(nodes)
         # Reset propagation flag
         finally:
             self._propagating = False
 
+    def _defer(self, node):
+        """Mark an unobserved lazy node as dirty instead of computing it."""
+        if node not in self._lazy or self._observed(node):
+            return False
+        self._dirty.add(node)
+        self._schedule_subscribers(node)
+        return True
+
+    def _throttle(self, node):
+        """Coalesce the update of a node computed less than its minimum
+        interval ago, and make sure a trailing update is scheduled."""
+        interval = self._intervals.get(node)
+        if interval is None:
+            return False
+        now = self.clock()
+        last = self._timestamps.get(node)
+        if last is None or now - last >= interval:
+            self._timestamps[node] = now
+            return False
+        node.counters['coalesced'] += 1
+        if node not in self._timers:
+            timer = threading.Timer(
+                last + interval - now, self._trailing_update, (node,))
+            timer.daemon = True
+            self._timers[node] = timer
+            timer.start()
+        return True
+
+    def _trailing_update(self, node):
+        if self.timer_lock is None:
+            return self._run_trailing_update(node)
+        with self.timer_lock():
+            return self._run_trailing_update(node)
+
+    def _run_trailing_update(self, node):
+        # The timer might have been cancelled in the meantime
+        if self._timers.pop(node, None) is None:
+            return
+        # Force the update
+        self._timestamps.pop(node, None)
+        self.schedule(node)
+        if not self._propagating and not self._transactions:
+            self.propagate()
+
+    def _cancel_timer(self, node):
+        timer = self._timers.pop(node, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _pop_rank(self):
+        """Pop the pending nodes with the lowest rank.
+
+        Those nodes are independent of each other. Without executor,
+        a single node is returned.
+        """
+        nodes, current = [], None
+        while self._queue:
+            rank, index, _, node = self._queue[0]
+            if nodes and (self.executor is None or rank != current):
+                break
+            heapq.heappop(self._queue)
+            # The rule might have been removed, or the index reused
+            if self._table[index] is not node or \
+               not self._pending & 1 << index:
+                continue
+            # The node might have been ranked again
+            if self._ranks.get(node) != rank:
+                if node in self._ranks:
+                    self._push(node, index)
+                continue
+            self._pending &= ~(1 << index)
+            nodes.append(node)
+            current = rank
+        return nodes
+
+    @contextmanager
+    def transaction(self):
+        """Defer the propagation until the end of the block.
+
+        The updates triggered by all the changes in the block are then
+        merged into a single propagation wave.
+        """
+        self._transactions += 1
+        try:
+            yield self
+        finally:
+            self._transactions -= 1
+            if not self._propagating and not self._transactions:
+                self.propagate()
+
     def update(self, node):
-        callback = self._updates[node]
+        self._evaluate_publishers(node)
+        self._dirty.discard(node)
+        self._update(node)
+
+    def _update(self, node):
+        self._apply(node, partial(self._call, node))
+
+    def _call(self, node):
+        """Run the rule of a node, and profile it if enabled."""
+        if not self.profiling:
+            return self._updates[node]()
+        start = self.clock()
         try:
-            node.set_result(callback())
+            return self._updates[node]()
+        finally:
+            self._profile(node).add_call(self.clock() - start, self._wave)
+
+    def _apply(self, node, func):
+        """Set the result of func to a node (or the exception it raised)."""
+        try:
+            self._notify(node, node.set_result, func())
         except Exception as exc:
-            node.set_exception(exc)
+            self._notify(node, node.set_exception, exc)
+
+    def _notify(self, node, setter, value):
+        """Run a node setter, and profile the notify time if enabled."""
+        if not self.profiling:
+            return setter(value)
+        start = self.clock()
+        try:
+            setter(value)
+        finally:
+            self._profile(node).notify_time += self.clock() - start
+
+    def _profile(self, node):
+        profile = self._profiles.get(node)
+        if profile is None:
+            profile = self._profiles.setdefault(node, RuleProfile())
+        return profile
+
+    def _evaluate_publishers(self, node):
+        if not self._dirty:
+            return
+        for publisher in self._publishers(node):
+            self.evaluate(publisher)
+        # The node might have been scheduled again by its publishers
+        self._pending &= ~(1 << self._ids[node])
+
+    def update_all(self, nodes):
+        # Compute the dirty publishers of the whole batch first
+        for node in nodes:
+            self._evaluate_publishers(node)
+        # They might have scheduled the nodes of the batch again
+        for node in nodes:
+            self._pending &= ~(1 << self._ids[node])
+            self._dirty.discard(node)
+        futures = [
+            self.executor.submit(self._call, node) for node in nodes]
+        for node, future in zip(nodes, futures):
+            self._apply(node, future.result)
 
     # Dict interface
 
@@ -9,9 +9,9 @@ from tango import AttrWriteType
 from tango.server import device_property, command, attribute
 
 # Local imports
-from facadedevice.graph import RestrictedNode, triplet
-from facadedevice.utils import attributes_from_wildcard
-from facadedevice.utils import check_attribute, make_subcommand
+from facadedevice.graph import RestrictedNode, RuleCache, triplet, DEEP
+from facadedevice.graph import Columns, ColumnNode
+from facadedevice.reducers import Reduction, DeltaReducer, make_reducer
 
 
 # Base class object
@@ -42,6 +42,10 @@ class class_object(object):
 class node_object(class_object):
 
     callback = None
+    compare = DEEP
+    abs_change = None
+    rel_change = None
+    priority = 0
 
     def notify(self, callback):
         """Use as a decorator to register a callback."""
@@ -49,7 +53,10 @@ class node_object(class_object):
         return callback
 
     def configure(self, device):
-        node = RestrictedNode(self.key)
+        node = RestrictedNode(
+            self.key, compare=self.compare,
+            abs_change=self.abs_change, rel_change=self.rel_change)
+        node.priority = self.priority
         device.graph.add_node(node)
         # No user callback
         if not self.callback:
@@ -63,7 +70,8 @@ class node_object(class_object):
     # Binding helper
 
     @staticmethod
-    def bind_node(device, node, bind, method, standard_aggregation=True):
+    def bind_node(device, node, bind, method, standard_aggregation=True,
+                  lazy=False, min_interval=None):
         if not method:
             raise ValueError('No update method defined')
         if not bind:
@@ -73,7 +81,8 @@ class node_object(class_object):
             device._standard_aggregation if standard_aggregation
             else device._custom_aggregation)
         func = partial(aggregate, node, method.__get__(device))
-        device.graph.add_rule(node, func, bind)
+        device.graph.add_rule(
+            node, func, bind, lazy=lazy, min_interval=min_interval)
 
 
 # Local attribute
@@ -89,13 +98,39 @@ class local_attribute(node_object):
     Args:
         create_attribute (str):
             Create the corresponding tango attribute. Default is True.
+        compare (str):
+            Strategy to detect a change in the value: 'deep' (default),
+            'hash', 'identity' or 'always'.
+        abs_change (float):
+            Don't propagate the new values that differ from the last
+            propagated one by less than this absolute amount (per element).
+            They are still read. Also used as tango event criteria.
+            Default is None.
+        rel_change (float):
+            Same as abs_change, relative to the current value (in percent).
+            Default is None.
+        priority (int):
+            Priority of the updates in the event queue. The remote nodes
+            take the highest priority of the nodes they update. Default is 0.
     """
 
-    def __init__(self, create_attribute=True, **kwargs):
+    def __init__(self, create_attribute=True, compare=DEEP,
+                 abs_change=None, rel_change=None, priority=0, **kwargs):
         if not create_attribute and kwargs:
             raise ValueError("Attribute creation is disabled")
         self.method = None
+        self.compare = compare
+        self.abs_change = abs_change
+        self.rel_change = rel_change
+        self.priority = priority
         self.kwargs = kwargs if create_attribute else None
+        # Deadbands are also tango event criteria
+        if self.kwargs is None:
+            return
+        if abs_change is not None:
+            self.kwargs['abs_change'] = str(abs_change)
+        if rel_change is not None:
+            self.kwargs['rel_change'] = str(rel_change)
 
     def __call__(self, method):
         self.method = method
@@ -184,24 +219,78 @@ class logical_attribute(local_attribute):
             List of node names to bind to. It has to contain at least one name.
         standard_aggregation (optional, bool):
             Use the default aggregation mecanism. Default is True.
+        memoize (optional, bool):
+            Skip the computation if the input values didn't change.
+            It requires a pure function and the standard aggregation.
+            Default is False.
+        cache_size (optional, int):
+            Also remember the results for that many (hashable) sets of
+            input values. It enables memoization. Default is 0.
+        lazy (optional, bool):
+            Only compute the value when it is read, needed by another node,
+            or when the attribute has event subscribers or a notify
+            callback. Default is False.
+        min_interval (optional, float):
+            Minimum interval between two computations, in seconds. The
+            updates in between are coalesced, and a trailing computation
+            uses the latest input values. Default is None.
+        max_rate (optional, float):
+            Maximum computation rate, in Hz. Alternative to min_interval.
+            Default is None.
+        compare (optional, str):
+            Strategy to detect a change in the value: 'deep' (default),
+            'hash', 'identity' or 'always'.
+        abs_change (optional, float):
+            Absolute deadband: smaller changes of the computed value are
+            not propagated. Default is None.
+        rel_change (optional, float):
+            Relative deadband (in percent). Default is None.
+        priority (optional, int):
+            Priority of the updates in the event queue. Default is 0.
         create_attribute (optional, bool):
             Create the corresponding tango attribute. Default is True.
     """
 
-    def __init__(self, bind, standard_aggregation=True, **kwargs):
+    def __init__(self, bind, standard_aggregation=True,
+                 memoize=False, cache_size=0, lazy=False,
+                 min_interval=None, max_rate=None, **kwargs):
         self.bind = bind
         self.method = None
         self.standard_aggregation = standard_aggregation
+        self.memoize = memoize or cache_size > 0
+        self.cache_size = cache_size
+        self.lazy = lazy
+        self.min_interval = min_interval
+        if self.memoize and not standard_aggregation:
+            raise ValueError("Memoization requires the standard aggregation")
+        if max_rate is not None:
+            if min_interval is not None:
+                raise ValueError("Use either min_interval or max_rate")
+            self.min_interval = 1. / max_rate
         super(logical_attribute, self).__init__(**kwargs)
 
     def configure(self, device):
         super(logical_attribute, self).configure(device)
         node = device.graph[self.key]
+        if self.memoize:
+            node.cache = RuleCache(self.cache_size)
+        if self.lazy:
+            self.configure_observers(device, node)
         self.configure_binding(device, node)
 
+    def configure_observers(self, device, node):
+        # The user callback always needs the value
+        if self.callback:
+            device.graph.observe(node)
+        # Event subscribers need the value
+        elif self.kwargs is not None:
+            predicate = partial(device._has_event_subscriber, self.key)
+            device.graph.observe(node, predicate)
+
     def configure_binding(self, device, node):
         self.bind_node(
-            device, node, self.bind, self.method, self.standard_aggregation)
+            device, node, self.bind, self.method, self.standard_aggregation,
+            self.lazy, self.min_interval)
 
     def connect(self, device):
         # Override the local_attribute connect method
@@ -220,6 +309,19 @@ class proxy_attribute(logical_attribute):
             Create the corresponding device property. Default is True.
         standard_aggregation (optional, bool):
             Use the default aggregation mecanism. Default is True.
+        memoize (optional, bool):
+            Skip the computation if the input value didn't change.
+            Default is False.
+        compare (optional, str):
+            Strategy to detect a change in the remote value: 'deep'
+            (default), 'hash', 'identity' or 'always'.
+        abs_change (optional, float):
+            Absolute deadband: smaller changes of the value are not
+            propagated. Default is None.
+        rel_change (optional, float):
+            Relative deadband (in percent). Default is None.
+        priority (optional, int):
+            Priority of the updates in the event queue. Default is 0.
         create_attribute (optional, bool):
             Create the corresponding tango attribute. Default is True.
 
@@ -264,23 +366,27 @@ class proxy_attribute(logical_attribute):
             return
         # Check attribute
         attr = attr.lower()
-        check_attribute(attr, writable=self.use_default_write)
+        device.defer_remote_check(partial(
+            device._check_remote_attribute, attr,
+            writable=self.use_default_write))
         # Make subcommand
         if self.use_default_write:
-            subcommand = make_subcommand(attr, attr=True)
-            device._subcommand_dict[self.key] = subcommand
+            device.defer_remote_check(
+                partial(device._make_remote_subcommand, attr, attr=True),
+                partial(device._subcommand_dict.__setitem__, self.key))
         # Add attribute
         if self.method is None:
             node.remote_attr = attr
             return
         # Add subnode
         bind = (self.key + "[0]",)
-        subnode = RestrictedNode(bind[0])
+        subnode = RestrictedNode(bind[0], compare=self.compare)
         subnode.remote_attr = attr
         device.graph.add_node(subnode)
         # Binding
         self.bind_node(
-            device, node, bind, self.method, self.standard_aggregation)
+            device, node, bind, self.method, self.standard_aggregation,
+            self.lazy, self.min_interval)
 
     def connect(self, device):
         node = device.graph[self.key]
@@ -313,12 +419,55 @@ class combined_attribute(proxy_attribute):
             Create the corresponding device property. Default is True.
         standard_aggregation (optional, bool):
             Use the default error aggregation mecanism. Default is True.
+        memoize (optional, bool):
+            Skip the computation if the input values didn't change.
+            Default is False.
+        reducer (optional, str or Reducer subclass):
+            Incremental reducer used instead of the decorated method: 'sum',
+            'mean', 'count' (of true values), 'min', 'max', 'any' or 'all'.
+            Only the changed values are processed, so it can't be combined
+            with memoization. Default is None.
+        delta (optional, bool):
+            Call the decorated method with a dictionnary of the changed
+            values only, as <index, value> (None if the value is not
+            available anymore). Can't be combined with memoization either.
+            Default is False.
+        columnar (optional, bool):
+            Store the subnode results in preallocated numpy arrays, and
+            call the decorated method with a single read-only array of
+            values. Default is False.
         create_attribute (optional, bool):
             Create the corresponding tango attribute. Default is True.
 
     Also supports the standard attribute keywords.
     """
 
+    def __init__(self, property_name, create_property=True,
+                 reducer=None, delta=False, columnar=False, **kwargs):
+        self.reducer = reducer
+        self.delta = delta
+        self.columnar = columnar
+        if reducer is not None:
+            make_reducer(reducer)
+        if reducer is not None and delta:
+            raise ValueError("Use either a reducer or a delta method")
+        if columnar and (reducer is not None or delta):
+            raise ValueError("Reducers don't support columnar storage")
+        super(combined_attribute, self).__init__(
+            property_name, create_property, **kwargs)
+        if self.incremental and not self.standard_aggregation:
+            raise ValueError("Reducers require the standard aggregation")
+        if self.incremental and self.memoize:
+            raise ValueError("Reducers don't support memoization")
+        if columnar and (self.memoize or not self.standard_aggregation):
+            raise ValueError(
+                "Columnar storage requires the standard aggregation, "
+                "without memoization")
+
+    @property
+    def incremental(self):
+        return self.reducer is not None or self.delta
+
     def update_class(self, key, dct):
         # Parent method
         super(combined_attribute, self).update_class(key, dct)
@@ -350,26 +499,63 @@ class combined_attribute(proxy_attribute):
         # Pattern matching
         if len(attrs) == 1:
             wildcard = attrs[0]
-            attrs = list(attributes_from_wildcard(wildcard))
+            attrs = device._expand_wildcard(wildcard)
             if not attrs:
                 msg = 'No attributes matching {} wildcard'
                 raise ValueError(msg.format(wildcard))
         # Check attributes
         else:
             for attr in attrs:
-                check_attribute(attr)
+                device.defer_remote_check(
+                    partial(device._check_remote_attribute, attr))
         # Build the bindings
         bind = tuple(
             '{}[{}]'.format(self.key, i)
             for i, _ in enumerate(attrs))
         # Build the subnodes
-        for key, attr in zip(bind, attrs):
-            subnode = RestrictedNode(key)
+        if self.columnar:
+            node.columns = Columns(len(bind))
+        for index, (key, attr) in enumerate(zip(bind, attrs)):
+            if self.columnar:
+                subnode = ColumnNode(
+                    key, node.columns, index, compare=self.compare)
+            else:
+                subnode = RestrictedNode(key, compare=self.compare)
             subnode.remote_attr = attr
             device.graph.add_node(subnode)
         # Set the binding
+        if self.columnar:
+            self.bind_columns(device, node, bind)
+            return
+        if self.incremental:
+            self.bind_reducer(device, node, bind)
+            return
         self.bind_node(
-            device, node, bind, self.method, self.standard_aggregation)
+            device, node, bind, self.method, self.standard_aggregation,
+            self.lazy, self.min_interval)
+
+    def bind_columns(self, device, node, bind):
+        if not self.method:
+            raise ValueError('No update method defined')
+        func = partial(
+            device._columnar_aggregation, node, self.method.__get__(device))
+        device.graph.add_rule(
+            node, func, bind, lazy=self.lazy, min_interval=self.min_interval)
+
+    def bind_reducer(self, device, node, bind):
+        if self.delta:
+            if not self.method:
+                raise ValueError('No update method defined')
+            reducer = DeltaReducer(self.method.__get__(device))
+        elif self.method:
+            raise ValueError('A reducer cannot have an update method')
+        else:
+            reducer = make_reducer(self.reducer)
+        node.reduction = Reduction(reducer, len(bind))
+        func = partial(device._incremental_aggregation, node)
+        device.graph.add_rule(
+            node, func, bind, lazy=self.lazy, min_interval=self.min_interval,
+            delta=True)
 
 
 # State attribute
@@ -383,11 +569,15 @@ class state_attribute(node_object):
             Default is None.
         standard_aggregation (optional, bool):
             Use the default error aggregation mecanism. Default is True.
+        priority (optional, int):
+            Priority of the updates in the event queue. Default is 1,
+            so the state inputs are processed first.
     """
 
-    def __init__(self, bind=None, standard_aggregation=True):
+    def __init__(self, bind=None, standard_aggregation=True, priority=1):
         self.bind = bind
         self.method = None
+        self.priority = priority
         self.standard_aggregation = standard_aggregation
 
     def __call__(self, method):
@@ -478,8 +668,10 @@ class proxy_command(class_object):
         if '/' not in name:
             value = literal_eval(name)
             subcommand = partial(device._emulate_subcommand, value)
-        # Check subcommand
+            device._subcommand_dict[self.key] = subcommand
+        # Check subcommand and set it
         else:
-            subcommand = make_subcommand(name, attr=self.write_attribute)
-        # Set subcommand
-        device._subcommand_dict[self.key] = subcommand
+            device.defer_remote_check(
+                partial(device._make_remote_subcommand, name,
+                        attr=self.write_attribute),
+                partial(device._subcommand_dict.__setitem__, self.key))
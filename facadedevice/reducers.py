@@ -0,0 +1,292 @@
+"""Provide incremental reducers for combined attributes."""
+
+# Imports
+import heapq
+import itertools
+from collections import Counter
+
+# Local imports
+from facadedevice.graph import triplet, INVALID
+from facadedevice.utils import aggregate_qualities
+
+
+# Base reducer
+
+class Reducer(object):
+    """Base class for the incremental reducers.
+
+    The reducer holds the current values by index. Subclasses update their
+    state in `add` and `remove`, and compute the reduction in `result`.
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def update(self, index, value):
+        """Set the value for a given index (None to remove it)."""
+        if index in self.values:
+            self.remove(index, self.values.pop(index))
+        if value is not None:
+            self.values[index] = value
+            self.add(index, value)
+
+    # Methods to override
+
+    def add(self, index, value):
+        pass  # pragma: no cover
+
+    def remove(self, index, value):
+        pass  # pragma: no cover
+
+    def result(self):
+        raise NotImplementedError  # pragma: no cover
+
+
+# Sum reducers
+
+class Sum(Reducer):
+    """Sum of the values, in O(1).
+
+    The sum is recomputed every N updates to avoid rounding drifts.
+    """
+
+    def __init__(self):
+        super(Sum, self).__init__()
+        self.total = 0
+        self.updates = 0
+
+    def add(self, index, value):
+        self.total = self.total + value
+        self.updates += 1
+
+    def remove(self, index, value):
+        self.total = self.total - value
+        self.updates += 1
+
+    def result(self):
+        if self.updates >= len(self.values):
+            self.total = sum(self.values.values())
+            self.updates = 0
+        return self.total
+
+
+class Mean(Sum):
+    """Mean of the values, in O(1)."""
+
+    def result(self):
+        total = super(Mean, self).result()
+        return total / float(len(self.values))
+
+
+class Count(Reducer):
+    """Number of true values, in O(1)."""
+
+    def __init__(self):
+        super(Count, self).__init__()
+        self.count = 0
+
+    def add(self, index, value):
+        self.count += bool(value)
+
+    def remove(self, index, value):
+        self.count -= bool(value)
+
+    def result(self):
+        return self.count
+
+
+class Any(Count):
+    """True if any value is true, in O(1)."""
+
+    def result(self):
+        return self.count > 0
+
+
+class All(Count):
+    """True if all the values are true, in O(1)."""
+
+    def result(self):
+        return self.count == len(self.values)
+
+
+# Heap reducers
+
+class _Reversed(object):
+    """Reverse the ordering of a value."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+class Min(Reducer):
+    """Minimum of the values, in O(log N).
+
+    The values have to be ordered scalars (numbers, strings, etc.).
+    Removed values are discarded lazily from the heap, which is rebuilt
+    when it gets too large.
+    """
+
+    def __init__(self):
+        super(Min, self).__init__()
+        self.heap = []
+        self.serials = {}
+        self.counter = itertools.count()
+
+    @staticmethod
+    def key(value):
+        return value
+
+    def add(self, index, value):
+        if getattr(value, 'ndim', 0):
+            raise TypeError('Cannot order array values')
+        serial = self.serials[index] = next(self.counter)
+        heapq.heappush(self.heap, (self.key(value), index, serial))
+        if len(self.heap) > 2 * len(self.values) + 16:
+            self.heap = [
+                (self.key(current), key, self.serials[key])
+                for key, current in self.values.items()]
+            heapq.heapify(self.heap)
+
+    def remove(self, index, value):
+        self.serials.pop(index, None)
+
+    def result(self):
+        while self.heap:
+            _, index, serial = self.heap[0]
+            if self.serials.get(index) == serial:
+                return self.values[index]
+            heapq.heappop(self.heap)
+        raise ValueError('No values to reduce')
+
+
+class Max(Min):
+    """Maximum of the values, in O(log N)."""
+
+    key = _Reversed
+
+
+# Delta reducer
+
+class DeltaReducer(Reducer):
+    """Forward the changes since the last computation to a function.
+
+    The function takes a dictionnary of <index, value> (None for the
+    removed values) and returns the new result.
+    """
+
+    def __init__(self, func):
+        super(DeltaReducer, self).__init__()
+        self.func = func
+        self.changes = {}
+
+    def add(self, index, value):
+        self.changes[index] = value
+
+    def remove(self, index, value):
+        self.changes[index] = None
+
+    def result(self):
+        # Keep the changes if the function fails
+        result = self.func(dict(self.changes))
+        self.changes = {}
+        return result
+
+
+# Reducer names
+
+REDUCERS = {
+    'sum': Sum,
+    'mean': Mean,
+    'count': Count,
+    'min': Min,
+    'max': Max,
+    'any': Any,
+    'all': All}
+
+
+def make_reducer(reducer):
+    """Return a new reducer from a name or a Reducer subclass."""
+    if isinstance(reducer, type) and issubclass(reducer, Reducer):
+        return reducer()
+    try:
+        return REDUCERS[reducer]()
+    except (KeyError, TypeError):
+        message = "Not a valid reducer: {!r}"
+        raise ValueError(message.format(reducer))
+
+
+# Reduction object
+
+class Reduction(object):
+    """Aggregate indexed nodes incrementally, as the standard aggregation.
+
+    The subnodes are missing until they are updated. The first exception
+    is forwarded, an invalid quality gives an invalid result, and the
+    stamps and qualities are aggregated.
+    """
+
+    def __init__(self, reducer, size):
+        self.reducer = reducer
+        self.stamps = Max()
+        self.qualities = Counter()
+        self.errors = {}
+        self.invalid = set()
+        self.missing = set(range(size))
+        self._qualities = {}
+
+    def update(self, index, node):
+        # Clear the previous state
+        self.errors.pop(index, None)
+        self.invalid.discard(index)
+        self.missing.discard(index)
+        quality = self._qualities.pop(index, None)
+        if quality is not None:
+            self.qualities[quality] -= 1
+            if not self.qualities[quality]:
+                del self.qualities[quality]
+        # Exception or empty node
+        exception = node.exception()
+        result = None if exception is not None else node.result()
+        if result is None:
+            if exception is not None:
+                self.errors[index] = exception
+            else:
+                self.missing.add(index)
+            self.stamps.update(index, None)
+            self.reducer.update(index, None)
+            return
+        # Metadata
+        value, stamp, quality = result
+        self.stamps.update(index, stamp)
+        self.qualities[quality] += 1
+        self._qualities[index] = quality
+        # Invalid quality
+        if quality == INVALID:
+            self.invalid.add(index)
+            value = None
+        self.reducer.update(index, value)
+
+    def exception(self):
+        if not self.errors:
+            return None
+        return self.errors[min(self.errors)]
+
+    def result(self):
+        if self.missing:
+            return None
+        stamp = self.stamps.result()
+        if self.invalid:
+            return triplet.unchecked(None, stamp, INVALID)
+        result = self.reducer.result()
+        if isinstance(result, triplet):
+            return result
+        quality = aggregate_qualities(list(self.qualities))
+        return triplet.unchecked(result, stamp, quality)
@@ -1,11 +1,18 @@
 """Provide helpers for tango."""
 
 # Imports
+import os
+import re
 import time
+import json
 import fnmatch
+import tempfile
+import threading
 import itertools
 import functools
 import collections
+from timeit import default_timer
+from concurrent.futures import ThreadPoolExecutor
 
 # Conditional imports
 try:
@@ -50,6 +57,13 @@ def aggregate_qualities(qualities):
     return AttrQuality.values[result]
 
 
+def aggregate_quality_array(qualities):
+    # Vectorized version, for a numpy array of integer qualities
+    length = len(AttrQuality.values)
+    result = (((qualities - 1) % length).min() + 1) % length
+    return AttrQuality.values[int(result)]
+
+
 # Patched device proxy
 
 def create_device_proxy(*args, **kwargs):
@@ -58,6 +72,90 @@ def create_device_proxy(*args, **kwargs):
     return proxy
 
 
+# Device proxy pool
+
+class _Connection(object):
+
+    def __init__(self):
+        self.proxy = None
+        self.error = None
+        self.ready = threading.Event()
+
+
+class ProxyPool(object):
+    """Share the device proxies of a process, by device name.
+
+    A device is connected to once: the concurrent requests for a device
+    being connected wait for that connection.
+
+    If max_idle is set, the proxies that haven't been requested for that
+    many seconds are dropped from the pool (their current users keep them).
+    """
+
+    def __init__(self, max_idle=None):
+        self.max_idle = max_idle
+        self.clock = default_timer
+        self._lock = threading.Lock()
+        self._proxies = {}
+        self._connections = {}
+
+    def get(self, device_name):
+        key = device_name.lower()
+        now = self.clock()
+        with self._lock:
+            self._evict(now)
+            if key in self._proxies:
+                proxy, _ = self._proxies[key]
+                self._proxies[key] = proxy, now
+                return proxy
+            connection = self._connections.get(key)
+            pending = connection is not None
+            if not pending:
+                connection = self._connections[key] = _Connection()
+        # Wait for the connection in progress
+        if pending:
+            connection.ready.wait()
+            if connection.error is not None:
+                raise connection.error
+            return connection.proxy
+        # Connect outside the lock
+        try:
+            connection.proxy = create_device_proxy(device_name)
+        except Exception as exc:
+            connection.error = exc
+            raise
+        else:
+            with self._lock:
+                self._proxies[key] = connection.proxy, now
+        finally:
+            with self._lock:
+                del self._connections[key]
+            connection.ready.set()
+        return connection.proxy
+
+    def _evict(self, now):
+        if self.max_idle is None:
+            return
+        for key, (_, stamp) in list(self._proxies.items()):
+            if now - stamp > self.max_idle:
+                del self._proxies[key]
+
+    def clear(self):
+        with self._lock:
+            self._proxies.clear()
+
+    def __len__(self):
+        return len(self._proxies)
+
+
+proxy_pool = ProxyPool()
+
+
+def get_device_proxy(device_name):
+    """Return a shared device proxy from the process pool."""
+    return proxy_pool.get(device_name)
+
+
 # Split attribute name
 
 def split_tango_name(name):
@@ -69,55 +167,468 @@ def split_tango_name(name):
 
 def check_attribute(name, writable=False):
     device, attr = split_tango_name(name)
-    proxy = create_device_proxy(device)
+    proxy = get_device_proxy(device)
     cfg = proxy.get_attribute_config(attr)
     if writable and cfg.writable is AttrWriteType.READ:
         raise ValueError("The attribute {} is not writable".format(name))
     return cfg
 
 
+def get_attribute_info(name, writable=False):
+    """Check an attribute and return a JSON-compatible summary of its config.
+    """
+    cfg = check_attribute(name, writable)
+    return {
+        'name': cfg.name,
+        'writable': int(cfg.writable),
+        'data_type': int(cfg.data_type),
+        'data_format': int(cfg.data_format)}
+
+
 # Attribute from wildcard
 
-def attributes_from_wildcard(wildcard):
+def attributes_from_wildcard(wildcard, workers=0, by_class=False):
+    """Expand an attribute wildcard, in the device order.
+
+    The attribute lists of the exported devices (and their classes, if
+    by_class is True) are queried concurrently if workers is set. If
+    by_class is True, a single device is queried for each device class
+    (this ignores the dynamic attributes).
+    """
     db = Database()
     wdev, wattr = split_tango_name(wildcard)
-    for device in db.get_device_exported(wdev):
-        proxy = create_device_proxy(device)
+    match = re.compile(fnmatch.translate(wattr)).match
+    devices = list(db.get_device_exported(wdev))
+
+    def query(device):
+        proxy = get_device_proxy(device)
         infos = proxy.attribute_list_query()
-        attrs = sorted(info.name.lower() for info in infos)
-        for attr in fnmatch.filter(attrs, wattr):
-            yield '{}/{}'.format(device.lower(), attr)
+        return sorted(info.name.lower() for info in infos)
+
+    executor = None
+    if workers and len(devices) > 1:
+        executor = ThreadPoolExecutor(min(workers, len(devices)))
+    run = map if executor is None else executor.map
+    try:
+        # Query a single device per class
+        sources = dict((device, device) for device in devices)
+        if by_class:
+            first = {}
+            classes = run(db.get_class_for_device, devices)
+            for device, cls in zip(devices, classes):
+                sources[device] = first.setdefault(cls, device)
+        queried = [device for device in devices if sources[device] == device]
+        # Query the attribute lists
+        lists = dict(zip(queried, run(query, queried)))
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+    # Filter
+    for device in devices:
+        for attr in lists[sources[device]]:
+            if match(attr):
+                yield '{}/{}'.format(device.lower(), attr)
 
 
 # Tango command check
 
 def check_command(name):
     device, cmd = split_tango_name(name)
-    proxy = create_device_proxy(device)
+    proxy = get_device_proxy(device)
     return proxy.command_query(cmd)
 
 
+def get_command_info(name):
+    """Check a command and return a JSON-compatible summary of its info."""
+    info = check_command(name)
+    return {
+        'name': info.cmd_name,
+        'in_type': int(info.in_type),
+        'out_type': int(info.out_type)}
+
+
 # Make subcommand
 
-def make_subcommand(name, attr=False):
+def make_subcommand(name, attr=False, check=True):
     # Check value
-    if attr:
+    if check and attr:
         check_attribute(name)
-    else:
+    elif check:
         check_command(name)
     # Create proxy
     device, obj = split_tango_name(name)
-    proxy = create_device_proxy(device)
+    proxy = get_device_proxy(device)
     # Make subcommand
     method = proxy.write_attribute if attr else proxy.command_inout
     return functools.partial(method, obj)
 
 
+# Persistent cache of remote queries
+
+class RemoteCache(object):
+    """Store JSON-compatible results of remote queries in a local file.
+
+    The entries expire after ttl seconds (if set). The file is replaced
+    atomically when saved, and ignored if its format version differs.
+    """
+
+    version = 1
+
+    def __init__(self, path, ttl=None):
+        self.path = path
+        self.ttl = ttl
+        self.clock = time.time
+        self._lock = threading.Lock()
+        self._entries = self._load()
+        self._dirty = False
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or \
+           data.get('version') != self.version:
+            return {}
+        return dict(data.get('entries', {}))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stamp, value = entry
+        if self.ttl is not None and self.clock() - stamp > self.ttl:
+            return None
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = [self.clock(), value]
+            self._dirty = True
+
+    def discard(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {'version': self.version, 'entries': self._entries}
+            dirname = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f, sort_keys=True)
+                    f.flush()
+                    os.fsync(f.fileno())
+                # Atomic on posix
+                getattr(os, 'replace', os.rename)(tmp, self.path)
+            except Exception:
+                os.remove(tmp)
+                raise
+            self._dirty = False
+
+    def __len__(self):
+        return len(self._entries)
+
+
+remote_caches = {}
+remote_caches_lock = threading.Lock()
+
+
+def get_remote_cache(path, ttl=None):
+    """Return the remote cache of the process for a given path."""
+    key = os.path.abspath(path)
+    with remote_caches_lock:
+        if key not in remote_caches:
+            remote_caches[key] = RemoteCache(path, ttl)
+        cache = remote_caches[key]
+    cache.ttl = ttl
+    return cache
+
+
+# Shared event subscriptions
+
+class _Subscription(object):
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.eid = None
+        self.error = None
+        self.last_event = None
+        self.sequence = 0
+        self.ready = threading.Event()
+        self.callbacks = collections.OrderedDict()
+
+
+class _Delivery(object):
+    """Deliver numbered events to a callback, dropping the older ones."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.sequence = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, sequence, event, blocking=True):
+        # A busy delivery is already handling a newer event
+        if not self._lock.acquire(blocking):
+            return
+        try:
+            if sequence > self.sequence:
+                self.sequence = sequence
+                self.callback(event)
+        finally:
+            self._lock.release()
+
+
+class SubscriptionRegistry(object):
+    """Share the event subscriptions between all the devices of a process.
+
+    Subscriptions are keyed by (device, attribute, event type, filters).
+    The remote device is subscribed to once, and each event is forwarded
+    to all the registered callbacks. A new callback for an existing
+    subscription receives the last event straight away. The remote
+    subscription is removed with its last callback.
+
+    The lock is never held while calling tango: a subscription in progress
+    is a pending entry, and the other callbacks for the same key wait for
+    it to be ready. The events are numbered, so a callback never receives
+    an event older than the one it already got (e.g. a replay racing with
+    a new event).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._keys = {}
+        self._counter = itertools.count(1)
+
+    def subscribe(self, device_name, proxy, attr_name, event_type, callback,
+                  filters=[], stateless=False):
+        """Register a callback and return its token."""
+        key = device_name.lower(), attr_name.lower(), event_type, \
+            tuple(filters)
+        token = next(self._counter)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                # New subscription (pending)
+                if entry is None:
+                    entry = _Subscription(proxy)
+                    entry.callbacks[token] = _Delivery(callback)
+                    self._entries[key] = entry
+                    self._keys[token] = key
+                    shared = False
+                    break
+                # Shared subscription
+                if entry.ready.is_set():
+                    delivery = _Delivery(callback)
+                    entry.callbacks[token] = delivery
+                    self._keys[token] = key
+                    sequence, event = entry.sequence, entry.last_event
+                    shared = True
+                    break
+            # Wait for the pending subscription
+            entry.ready.wait()
+            if entry.error is not None:
+                raise entry.error
+        # Replay the last event
+        if shared:
+            if event is not None:
+                delivery(sequence, event, blocking=False)
+            return token
+        # Subscribe outside the lock
+        try:
+            eid = proxy.subscribe_event(
+                attr_name, event_type,
+                functools.partial(self._dispatch, entry),
+                filters, stateless)
+        except Exception as exc:
+            with self._lock:
+                del self._entries[key]
+                del self._keys[token]
+                entry.error = exc
+                entry.ready.set()
+            raise
+        with self._lock:
+            entry.eid = eid
+            entry.ready.set()
+        return token
+
+    def unsubscribe(self, token):
+        with self._lock:
+            key = self._keys.pop(token)
+            entry = self._entries[key]
+            del entry.callbacks[token]
+            if entry.callbacks:
+                return
+            del self._entries[key]
+        entry.proxy.unsubscribe_event(entry.eid)
+
+    def count(self, token):
+        """Return the number of callbacks sharing a subscription."""
+        with self._lock:
+            key = self._keys.get(token)
+            if key is None:
+                return 0
+            return len(self._entries[key].callbacks)
+
+    def _dispatch(self, entry, event):
+        with self._lock:
+            entry.sequence += 1
+            entry.last_event = event
+            sequence = entry.sequence
+            deliveries = list(entry.callbacks.values())
+        for delivery in deliveries:
+            delivery(sequence, event)
+
+
+# Conflating event queue
+
+class ConflatingQueue(object):
+    """Keep the latest pending item for each key.
+
+    A new item replaces the pending item of the same key (conflation).
+    The queue should hold at most maxsize keys (if set): the items of new
+    keys are still queued when it is full, so that no key misses its latest
+    item, but they are counted as overflow. The items are drained by decreasing
+    priority, and in round-robin across their sources for a given priority.
+
+    If shed_threshold is set, the queue is overloaded when it holds more
+    keys than that, until it gets back to half of it. During an overload,
+    the items with a priority lower than shed_priority are shed: the latest
+    one of each key is kept aside, and queued again at the end of the
+    overload. The last overload episodes are recorded.
+    """
+
+    def __init__(self, maxsize=0, shed_threshold=0, shed_priority=1,
+                 history=10):
+        self.maxsize = maxsize
+        self.shed_threshold = shed_threshold
+        self.shed_priority = shed_priority
+        self.max_depth = 0
+        self.counters = collections.Counter()
+        self.episodes = collections.deque(maxlen=history)
+        self.episode = None
+        self.clock = time.time
+        self._cond = threading.Condition()
+        self._items = {}
+        self._levels = {}
+        self._shed = collections.OrderedDict()
+        self._closed = False
+
+    def put(self, key, item, priority=0, source=None):
+        """Queue an item and return False if the queue is over its size."""
+        with self._cond:
+            # Conflation
+            if key in self._items:
+                self.counters['conflated'] += 1
+                self._items[key] = self._items[key][:2] + (item,)
+                return True
+            # Shedding
+            if self.episode is not None and priority < self.shed_priority:
+                self.counters['shed'] += 1
+                self.episode['shed'] += 1
+                self._shed[key] = priority, source, item
+                return True
+            # Full queue
+            overflow = bool(self.maxsize) and len(self._items) >= self.maxsize
+            if overflow:
+                self.counters['overflow'] += 1
+            self._push(key, priority, source, item)
+            self._check_overload()
+            self._cond.notify()
+            return not overflow
+
+    def _push(self, key, priority, source, item):
+        self._items[key] = priority, source, item
+        sources = self._levels.setdefault(priority, collections.OrderedDict())
+        sources.setdefault(source, collections.OrderedDict())[key] = None
+        self.max_depth = max(self.max_depth, len(self._items))
+
+    def _check_overload(self):
+        if not self.shed_threshold:
+            return
+        depth = len(self._items)
+        # Start of an overload
+        if self.episode is None:
+            if depth > self.shed_threshold:
+                self.counters['overloads'] += 1
+                self.episode = {
+                    'start': self.clock(), 'duration': None,
+                    'peak': depth, 'shed': 0}
+            return
+        # End of an overload
+        self.episode['peak'] = max(self.episode['peak'], depth)
+        if depth > self.shed_threshold // 2:
+            return
+        self.episode['duration'] = self.clock() - self.episode['start']
+        self.episodes.append(self.episode)
+        self.episode = None
+        # Queue the shed items again
+        shed, self._shed = self._shed, collections.OrderedDict()
+        for key, (priority, source, item) in shed.items():
+            if key in self._items:
+                self._items[key] = self._items[key][:2] + (item,)
+            else:
+                self._push(key, priority, source, item)
+
+    def get_batch(self, limit=0):
+        """Wait for and return up to limit (if set) pending (key, item) pairs.
+
+        Return None once the queue is closed.
+        """
+        with self._cond:
+            while not self._items and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return None
+            batch = []
+            for priority in sorted(self._levels, reverse=True):
+                sources = self._levels[priority]
+                # Round-robin across the sources
+                while sources and not (limit and len(batch) >= limit):
+                    source, keys = sources.popitem(last=False)
+                    key, _ = keys.popitem(last=False)
+                    batch.append((key, self._items.pop(key)[2]))
+                    if keys:
+                        sources[source] = keys
+                if not sources:
+                    del self._levels[priority]
+                if limit and len(batch) >= limit:
+                    break
+            self.counters['batches'] += 1
+            self._check_overload()
+            return batch
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._items.clear()
+            self._levels.clear()
+            self._shed.clear()
+            self._cond.notify_all()
+
+    def shed(self):
+        """Return the number of items kept aside by the current overload."""
+        return len(self._shed)
+
+    def __len__(self):
+        return len(self._items)
+
+
 # Device class
 
 class EnhancedDevice(Device):
     """Enhanced version of server.Device"""
 
+    # Event subscriptions shared by all the devices of the process
+    subscriptions = SubscriptionRegistry()
+
     # Property
 
     @property
@@ -161,6 +672,7 @@ class EnhancedDevice(Device):
     def init_device(self):
         # Init attributes
         self._event_dict = {}
+        self._event_lock = threading.Lock()
         self._connected = False
         self._tango_properties = {}
         self._init_stamp = time.time()
@@ -206,17 +718,20 @@ class EnhancedDevice(Device):
 
     # Event subscribtion
 
-    def _wrap_callback(self, callback, eid):
+    def _wrap_callback(self, callback, eid, locked=True):
         def wrapped(event):
             # Fix libtango bug #316
             if self._init_ident is not None and \
                self._init_ident != get_ident():
                 return  # pragma: no cover
-            # Acquire monitor lock
+            # Acquire monitor lock (unless the callback is thread-safe)
             try:
-                with AutoTangoMonitor(self):
-                    if eid in self._event_dict:
-                        callback(event)
+                if locked:
+                    with AutoTangoMonitor(self):
+                        if eid in self._event_dict:
+                            callback(event)
+                elif eid in self._event_dict:
+                    callback(event)
             # Register exception
             except Exception as exc:
                 message = "Exception while running event callback {}"
@@ -224,34 +739,52 @@ class EnhancedDevice(Device):
         return wrapped
 
     def subscribe_event(self, attr_name, event_type, callback,
-                        filters=[], stateless=False, proxy=None):
+                        filters=[], stateless=False, proxy=None,
+                        locked=True):
         # Get proxy
         if proxy is None:
             device_name, attr_name = split_tango_name(attr_name)
-            proxy = create_device_proxy(device_name)
-        # Create callback
-        eid = next(self._eid_counter)
-        self._event_dict[eid] = proxy, attr_name, None
-        wrapped = self._wrap_callback(callback, eid)
-        # Subscribe
+            proxy = get_device_proxy(device_name)
+        else:
+            device_name = proxy.dev_name()
+        # Create callback (pending subscription)
+        with self._event_lock:
+            eid = next(self._eid_counter)
+            self._event_dict[eid] = proxy, attr_name, None, event_type
+        wrapped = self._wrap_callback(callback, eid, locked)
+        # Subscribe (the event lock is not held while calling tango)
         try:
-            proxy_eid = proxy.subscribe_event(
-                attr_name, event_type, wrapped, filters, stateless)
+            token = self.subscriptions.subscribe(
+                device_name, proxy, attr_name, event_type, wrapped,
+                filters, stateless)
         # Error
         except Exception:
-            del self._event_dict[eid]
+            with self._event_lock:
+                self._event_dict.pop(eid, None)
             raise
         # Success
-        self._event_dict[eid] = proxy, attr_name, proxy_eid, event_type
+        with self._event_lock:
+            cancelled = eid not in self._event_dict
+            if not cancelled:
+                self._event_dict[eid] = proxy, attr_name, token, event_type
+        # Unsubscribed in the meantime
+        if cancelled:
+            self.subscriptions.unsubscribe(token)
+            msg = "The subscription to {} has been cancelled"
+            raise RuntimeError(msg.format(attr_name))
         return eid
 
     def unsubscribe_event(self, eid):
-        proxy, _, proxy_eid, _ = self._event_dict.pop(eid)
-        proxy.unsubscribe_event(proxy_eid)
+        with self._event_lock:
+            _, _, token, _ = self._event_dict.pop(eid, (None,) * 4)
+        # Pending subscriptions are cancelled by subscribe_event
+        if token is not None:
+            self.subscriptions.unsubscribe(token)
 
     def unsubscribe_all(self):
-        for eid in list(self._event_dict):
-            proxy, attr_name, _, _ = self._event_dict[eid]
+        with self._event_lock:
+            items = list(self._event_dict.items())
+        for eid, (proxy, attr_name, _, _) in items:
             attr_name = '/'.join((proxy.dev_name(), attr_name))
             try:
                 self.unsubscribe_event(eid)
@@ -297,11 +830,19 @@ class EnhancedDevice(Device):
             lines.append("The device is currently stopped because of:")
             lines.append(self.get_status())
         # Event subscription
-        if self._event_dict:
+        with self._event_lock:
+            subscriptions = [
+                value for value in self._event_dict.values()
+                if value[2] is not None]
+        if subscriptions:
             lines.append("It subscribed to event channel "
                          "of the following attribute(s):")
-            for proxy, attr_name, _, event_type in self._event_dict.values():
+            for proxy, attr_name, token, event_type in subscriptions:
                 attr_name = '/'.join((proxy.dev_name(), attr_name))
+                count = self.subscriptions.count(token)
+                if count > 1:
+                    event_type = "{}, shared by {} callbacks".format(
+                        event_type, count)
                 lines.append("- {} ({})".format(attr_name, event_type))
         else:
             lines.append("It doesn't hold a subsription to any event channel.")
@@ -318,5 +859,13 @@ class EnhancedDevice(Device):
         else:
             msg = "No errors in history since {} (last initialization)."
             lines.append(msg.format(strtime))
+        # Extra information
+        for section in self.get_extra_info():
+            lines.append("-" * 5)
+            lines.extend(section)
         # Return result
         return '\n'.join(lines)
+
+    def get_extra_info(self):
+        """Return extra sections (lists of lines) for GetInfo."""
+        return []
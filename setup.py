@@ -44,7 +44,8 @@ setup(
         'Topic :: Software Development :: Libraries'],
 
     # Requirements
-    install_requires=['pytango>=9.2.1', 'numpy'],
+    install_requires=['pytango>=9.2.1', 'numpy',
+                      'futures; python_version < "3"'],
     tests_require=['pytest-mock',
                    'pytest-xdist',
                    'pytest-coverage',
@@ -0,0 +1,18 @@
+"""Contain the shared fixtures of the tests."""
+
+# Imports
+import pytest
+
+# Facade imports
+from facadedevice import utils
+
+
+@pytest.fixture(autouse=True)
+def process_wide_state():
+    # Don't share the proxies and subscriptions between the tests
+    utils.proxy_pool.clear()
+    utils.EnhancedDevice.subscriptions = utils.SubscriptionRegistry()
+    with utils.remote_caches_lock:
+        utils.remote_caches.clear()
+    yield
+    utils.proxy_pool.clear()
@@ -2,6 +2,7 @@
 
 # Imports
 import pytest
+import threading
 from collections import namedtuple, OrderedDict
 
 # Tango imports
@@ -88,6 +89,147 @@ def test_combined_attribute(mocker):
         cb_mock.assert_called_once_with(*expected)
 
 
+def test_combined_attribute_with_reducer(mocker):
+
+    class Test(Facade):
+
+        attr = combined_attribute(
+            dtype=float,
+            property_name='prop',
+            reducer='max')
+
+        @combined_attribute(
+            dtype=float,
+            property_name='prop',
+            create_property=False,
+            delta=True)
+        def delta(self, changes):
+            delta_mock(changes)
+            return len(changes)
+
+    delta_mock = mocker.Mock()
+    change_events, archive_events = event_mock(mocker, Test)
+
+    mocker.patch('facadedevice.utils.DeviceProxy')
+    inner_proxy = utils.DeviceProxy.return_value
+    inner_proxy.dev_name.return_value = 'a/b/c'
+    subscribe_event = inner_proxy.subscribe_event
+
+    props = {'prop': ['a/b/c/d', 'e/f/g/h', 'i/j/k/l']}
+
+    with DeviceTestContext(Test, properties=props) as proxy:
+        # Device not in fault
+        assert proxy.state() == DevState.UNKNOWN
+        # Shared subscriptions
+        assert subscribe_event.call_count == 3
+        cbs = [x[0][2] for x in subscribe_event.call_args_list]
+        # Trigger events
+        event = mocker.Mock(spec=EventData)
+        event.errors = False
+        values = [
+            (1.1, 0.1, AttrQuality.ATTR_CHANGING),
+            (3.3, 0.3, AttrQuality.ATTR_VALID),
+            (2.2, 0.2, AttrQuality.ATTR_VALID)]
+        for i, (value, stamp, quality) in enumerate(values):
+            event.attr_value.value = value
+            event.attr_value.time.totime.return_value = stamp
+            event.attr_value.quality = quality
+            event.attr_name = props['prop'][i]
+            cbs[i](event)
+        expected = 3.3, 0.3, AttrQuality.ATTR_CHANGING
+        change_events['attr'].assert_called_once_with(*expected)
+        delta_mock.assert_called_once_with({0: 1.1, 1: 3.3, 2: 2.2})
+        # Single change
+        event.attr_value.value = 0.5
+        event.attr_value.time.totime.return_value = 0.4
+        event.attr_name = props['prop'][1]
+        cbs[1](event)
+        expected = 2.2, 0.4, AttrQuality.ATTR_CHANGING
+        change_events['attr'].assert_called_with(*expected)
+        delta_mock.assert_called_with({1: 0.5})
+        # Check info
+        info = proxy.getinfo()
+        assert "- a/b/c/d (CHANGE_EVENT, shared by 2 callbacks)" in info
+
+
+def test_columnar_combined_attribute(mocker):
+
+    class Test(Facade):
+
+        @combined_attribute(
+            dtype=float,
+            property_name='prop',
+            columnar=True)
+        def attr(self, values):
+            values_mock(values, self.get_combined_results('attr', True))
+            return values.sum()
+
+    values_mock = mocker.Mock()
+    change_events, archive_events = event_mock(mocker, Test)
+
+    mocker.patch('facadedevice.utils.DeviceProxy')
+    inner_proxy = utils.DeviceProxy.return_value
+    inner_proxy.dev_name.return_value = 'a/b/c'
+    subscribe_event = inner_proxy.subscribe_event
+
+    props = {'prop': ['a/b/c/d', 'e/f/g/h']}
+
+    with DeviceTestContext(Test, properties=props):
+        cbs = [x[0][2] for x in subscribe_event.call_args_list]
+        event = mocker.Mock(spec=EventData)
+        event.errors = False
+        values = [
+            (1.5, 0.1, AttrQuality.ATTR_CHANGING),
+            (2.5, 0.2, AttrQuality.ATTR_ALARM)]
+        for i, (value, stamp, quality) in enumerate(values):
+            event.attr_value.value = value
+            event.attr_value.time.totime.return_value = stamp
+            event.attr_value.quality = quality
+            event.attr_name = props['prop'][i]
+            cbs[i](event)
+        expected = 4., 0.2, AttrQuality.ATTR_ALARM
+        change_events['attr'].assert_called_once_with(*expected)
+        array, columns = values_mock.call_args[0]
+        assert array.tolist() == [1.5, 2.5]
+        assert not array.flags.writeable
+        # Zero-copy results
+        assert columns.attrs == props['prop']
+        assert columns.values.base is array.base
+        assert columns.stamps.tolist() == [0.1, 0.2]
+        assert columns.qualities.tolist() == [
+            int(AttrQuality.ATTR_CHANGING), int(AttrQuality.ATTR_ALARM)]
+        assert columns.present.all()
+        # Invalid quality
+        event.attr_value.quality = AttrQuality.ATTR_INVALID
+        cbs[1](event)
+        expected = 0., 0.2, AttrQuality.ATTR_INVALID
+        change_events['attr'].assert_called_with(*expected)
+        assert values_mock.call_count == 1
+
+
+def test_combined_attribute_with_wrong_reducer():
+
+    with pytest.raises(ValueError):
+        combined_attribute(property_name='prop', reducer='median')
+
+    with pytest.raises(ValueError):
+        combined_attribute(
+            property_name='prop', reducer='sum', delta=True)
+
+    with pytest.raises(ValueError):
+        combined_attribute(
+            property_name='prop', reducer='sum',
+            standard_aggregation=False)
+
+    with pytest.raises(ValueError):
+        combined_attribute(
+            property_name='prop', reducer='sum', memoize=True)
+
+    with pytest.raises(ValueError):
+        combined_attribute(
+            property_name='prop', delta=True, cache_size=10)
+
+
 def test_writable_combined_attribute(mocker):
 
     with pytest.raises(ValueError) as ctx:
@@ -210,6 +352,81 @@ def test_combined_attribute_with_wildcard(mocker):
         archive_events['attr'].assert_called_once_with(*expected)
 
 
+def test_combined_attribute_shared_wildcard(mocker):
+
+    class Test(Facade):
+
+        wildcard_by_class = True
+
+        @combined_attribute(
+            dtype=float,
+            property_name='prop1')
+        def attr1(self, *values):
+            return sum(values)
+
+        @combined_attribute(
+            dtype=float,
+            property_name='prop2')
+        def attr2(self, *values):
+            return max(values)
+
+    named = namedtuple('named', 'name')
+    change_events, archive_events = event_mock(mocker, Test)
+    mocker.patch('facadedevice.utils.DeviceProxy')
+    mocker.patch('facadedevice.utils.Database')
+    db = utils.Database.return_value
+    db.get_device_exported.return_value = ['a/b/c', 'a/b/d', 'a/b/e']
+    classes = {'a/b/c': 'Gauge', 'a/b/d': 'Pump', 'a/b/e': 'Gauge'}
+    db.get_class_for_device.side_effect = classes.get
+    inner_proxy = utils.DeviceProxy.return_value
+    inner_proxy.dev_name.return_value = 'a/b/c'
+    infos = [named(name) for name in ['X', 'Z', 'Z2']]
+    inner_proxy.attribute_list_query.return_value = infos
+
+    props = {'prop1': ['a/b/*/z'], 'prop2': ['a/b/*/z']}
+
+    with DeviceTestContext(Test, properties=props) as proxy:
+        # Device not in fault
+        assert proxy.state() == DevState.UNKNOWN
+        # A single query per class, for both attributes
+        db.get_device_exported.assert_called_once_with('a/b/*')
+        assert inner_proxy.attribute_list_query.call_count == 2
+        # Same remote attributes
+        info = proxy.getinfo()
+        assert info.count("(CHANGE_EVENT, shared by 2 callbacks)") == 6
+
+
+def test_wildcard_class_lookups(mocker):
+    mocker.patch('facadedevice.utils.DeviceProxy')
+    mocker.patch('facadedevice.utils.Database')
+    db = utils.Database.return_value
+    db.get_device_exported.return_value = ['a/b/c', 'a/b/d']
+
+    # Both class lookups have to run at the same time
+    condition = threading.Condition()
+    arrived = []
+
+    def get_class_for_device(device):
+        with condition:
+            arrived.append(device)
+            condition.notify_all()
+            while len(arrived) < 2:
+                condition.wait(2)
+                if len(arrived) < 2:
+                    raise RuntimeError('Not concurrent')
+        return 'Gauge'
+
+    db.get_class_for_device.side_effect = get_class_for_device
+    named = namedtuple('named', 'name')
+    inner_proxy = utils.DeviceProxy.return_value
+    inner_proxy.attribute_list_query.return_value = [named('X')]
+
+    result = utils.attributes_from_wildcard(
+        'a/b/*/x', workers=2, by_class=True)
+    assert list(result) == ['a/b/c/x', 'a/b/d/x']
+    assert inner_proxy.attribute_list_query.call_count == 1
+
+
 def test_combined_attribute_with_empty_wildcard(mocker):
 
     class Test(Facade):
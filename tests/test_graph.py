@@ -1,10 +1,20 @@
 
 # Imports
+import copy
 import numpy
 import pytest
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Tango imports
+from tango import DevFailed, Except
 
 # Facade imports
+from facadedevice.exception import context, ContextException
 from facadedevice.graph import Node, RestrictedNode, Graph, triplet
+from facadedevice.graph import RuleCache, content_hash
+from facadedevice.graph import Columns, ColumnNode
+from facadedevice.graph import ALWAYS, IDENTITY, HASH, DEEP
 from facadedevice.graph import VALID, INVALID
 from facadedevice.graph import patched_array_equal
 
@@ -61,6 +71,29 @@ def test_triplet_constructor():
     value, stamp, quality = triplet(1)
     assert value == 1
     assert quality == VALID
+    # Unchecked constructor
+    a = triplet.unchecked(1, 0.0)
+    assert a == triplet(1, 0.0)
+    assert type(a) is triplet
+    assert triplet.unchecked(1, 0.0, INVALID) == (None, 0.0, INVALID)
+    assert triplet.unchecked(None, 0.0) == (None, 0.0, INVALID)
+    # Tuple interface
+    assert a.value == 1 and a.stamp == 0.0 and a.quality == VALID
+    assert a._replace(stamp=1.0) == triplet(1, 1.0)
+    with pytest.raises(ValueError):
+        a._replace(other=1)
+    assert a._fields == ('value', 'stamp', 'quality')
+    assert a._asdict() == {'value': 1, 'stamp': 0.0, 'quality': VALID}
+    assert triplet._make([1, 0.0, VALID]) == a
+    assert type(triplet._make(a)) is triplet
+    with pytest.raises(TypeError):
+        triplet._make([1, 0.0])
+    assert triplet.__rawnew__(triplet, 1, 0.0, VALID) == a
+    assert repr(a) == "triplet(value=1, stamp=0.0, quality={!r})".format(VALID)
+    assert hash(a) == hash((1, 0.0, VALID))
+    assert copy.copy(a) == a
+    with pytest.raises(AttributeError):
+        a.value = 2
 
 
 def test_node_setters(mocker):
@@ -136,6 +169,123 @@ def test_node_setters(mocker):
         assert not m.called
 
 
+@pytest.mark.parametrize("compare", [ALWAYS, IDENTITY, HASH, DEEP])
+def test_node_comparison(mocker, compare):
+    mock = mocker.Mock()
+    n = RestrictedNode('test', callbacks=[mock], compare=compare)
+    assert n.compare == compare
+    assert n.version == 0
+    image = numpy.zeros((100, 100))
+    # Set triplet
+    n.set_result(triplet(image, 0.0))
+    assert n.version == 1
+    # Same object
+    n.set_result(triplet(image, 0.0))
+    assert n.version == (2 if compare == ALWAYS else 1)
+    # Same content
+    n.set_result(triplet(image.copy(), 0.0))
+    changed = compare in (ALWAYS, IDENTITY)
+    assert n.version == (3 if compare == ALWAYS else 1 + changed)
+    # Different content
+    version = n.version
+    n.set_result(triplet(image + 1, 0.0))
+    assert n.version == version + 1
+    # Different stamp
+    n.set_result(triplet(image + 1, 1.0))
+    assert n.version == version + 2
+    # Exception
+    n.set_exception(RuntimeError('Ooops'))
+    assert n.version == version + 3
+    n.set_result(triplet(image + 1, 1.0))
+    assert n.version == version + 4
+    n.set_result(None)
+    assert n.version == version + 5
+    assert mock.call_count == n.version
+    # Wrong strategy
+    with pytest.raises(ValueError):
+        Node('test', compare='wrong')
+
+
+def test_content_hash():
+    a = numpy.arange(10.)
+    assert content_hash(a) == content_hash(a.copy())
+    assert content_hash(a) != content_hash(a + 1)
+    assert content_hash(a) != content_hash(a.astype(int))
+    assert content_hash(a) != content_hash(a.reshape(2, 5))
+    assert content_hash(a[::2]) == content_hash(a[::2].copy())
+    assert content_hash([1, 2]) == content_hash([1, 2])
+    assert content_hash('test') == content_hash('test')
+    assert content_hash(1) != content_hash(1.5)
+    assert content_hash([{}]) is None
+    assert content_hash(-1) != content_hash(-2)
+
+
+def test_node_hash_comparison(mocker):
+    hashing = mocker.patch('facadedevice.graph.content_hash')
+    hashing.side_effect = content_hash
+    n = Node('test', compare=HASH)
+    # Colliding hashes for scalars
+    n.set_result(triplet(-1, 0.0))
+    n.set_result(triplet(-2, 0.0))
+    assert n.version == 2
+    n.set_result(triplet(-2, 0.0))
+    assert n.version == 2
+    assert not hashing.called
+    # No digest for different stamps
+    image = numpy.zeros(10)
+    n.set_result(triplet(image, 1.0))
+    n.set_result(triplet(image.copy(), 2.0))
+    assert n.version == 4
+    assert not hashing.called
+    # Digests for the same metadata
+    n.set_result(triplet(image.copy(), 2.0))
+    assert n.version == 4
+    assert hashing.call_count == 2
+    n.set_result(triplet(image + 1, 2.0))
+    assert n.version == 5
+    assert hashing.call_count == 3
+
+
+def test_node_deadband(mocker):
+    # Absolute deadband
+    node = Node('a', abs_change=0.5)
+    node.set_result(triplet(1., 0.))
+    callback = mocker.Mock()
+    node.callbacks.append(callback)
+    node.set_result(triplet(1.2, 1.))
+    assert node.result() == triplet(1.2, 1.)
+    assert node.counters['deadband'] == 1
+    # Compared to the last notified result
+    node.set_result(triplet(1.4, 1.5))
+    assert node.counters['deadband'] == 2
+    assert not callback.called
+    node.set_result(triplet(1.6, 2.))
+    callback.assert_called_once_with(node)
+    # Quality change
+    callback.reset_mock()
+    node.set_result(triplet(1.6, 3., INVALID))
+    callback.assert_called_once_with(node)
+    # NaN values
+    callback.reset_mock()
+    node.set_result(triplet(float('nan'), 4., INVALID))
+    callback.assert_called_once_with(node)
+    # Relative deadband, per element
+    node = Node('a', rel_change=10)
+    node.set_result(triplet(numpy.array([10., 100.])))
+    node.set_result(triplet(numpy.array([10.5, 95.])))
+    assert node.counters['deadband'] == 1
+    node.set_result(triplet(numpy.array([10.5, 120.])))
+    assert node.result().value.tolist() == [10.5, 120.]
+    # Shape change and non-numerical values
+    node.set_result(triplet(numpy.array([10.5])))
+    assert node.result().value.tolist() == [10.5]
+    node = Node('a', abs_change=1)
+    node.set_result('1')
+    node.set_result('1.5')
+    assert node.result() == '1.5'
+    assert not node.counters['deadband']
+
+
 def test_fail_node(mocker):
     mocks = [mocker.Mock(side_effect=RuntimeError)]
     n = Node('test', description='desc', callbacks=mocks)
@@ -159,6 +309,46 @@ def test_fail_node(mocker):
     assert "RuntimeError" in record[0].message.args[0]
 
 
+def test_duplicate_exceptions(mocker):
+    callback = mocker.Mock()
+    n = Node('test', callbacks=[callback])
+
+    def dev_failed(desc):
+        try:
+            Except.throw_exception('Reason', desc, 'origin')
+        except DevFailed as exc:
+            return exc
+
+    # Equivalent exceptions
+    n.set_exception(dev_failed('Ooops'))
+    n.set_exception(dev_failed('Ooops'))
+    assert callback.call_count == 1
+    assert n.counters['duplicate_exceptions'] == 1
+    # Different exceptions
+    n.set_exception(dev_failed('Nope'))
+    n.set_exception(RuntimeError('Nope'))
+    n.set_exception(RuntimeError('Nope'))
+    n.set_exception(ValueError('Nope'))
+    assert callback.call_count == 4
+    assert n.counters['duplicate_exceptions'] == 2
+    # Same object
+    exc = n.exception()
+    n.set_exception(exc)
+    assert n.counters['duplicate_exceptions'] == 2
+    # Context exceptions
+    for _ in range(2):
+        with pytest.raises(ContextException) as ctx:
+            with context('updating', n):
+                raise RuntimeError('Ooops')
+        n.set_exception(ctx.value)
+    assert callback.call_count == 5
+    assert n.counters['duplicate_exceptions'] == 3
+    # Unorderable arguments
+    n.set_exception(RuntimeError(numpy.arange(3)))
+    n.set_exception(RuntimeError(numpy.arange(3)))
+    assert callback.call_count == 7
+
+
 def test_simple_graph(mocker):
     a = Node('a')
     b = Node('b')
@@ -220,6 +410,8 @@ def test_cyclic_graph():
     with pytest.raises(ValueError) as context:
         g.build()
     assert "cyclic" in str(context.value)
+    path = str(context.value).split(': ')[1]
+    assert path in ("a -> b -> a", "b -> a -> b")
     assert a.callbacks == []
     assert b.callbacks == []
     # Test 2
@@ -230,18 +422,25 @@ def test_cyclic_graph():
     with pytest.raises(ValueError) as context:
         g.build()
     assert "cyclic" in str(context.value)
+    assert "a -> a" in str(context.value)
     assert a.callbacks == []
     # Test 3
-    a = Node('a')
     g = Graph()
-    g.build()
-    g._dependencies[a].add(a)
-    g._subscriptions[a].add(a)
-    g._updates[a] = lambda: a.result()
-    a.callbacks.append(g.callback)
-    with pytest.warns(UserWarning) as record:
-        a.set_result(1)
-    assert "deadlock" in record[0].message.args[0]
+    for x in "abcde":
+        g.add_node(Node(x))
+    g.add_rule(g['b'], lambda a, e: None, ['a', 'e'])
+    g.add_rule(g['c'], lambda b: None, ['b'])
+    g.add_rule(g['d'], lambda c: None, ['c'])
+    g.add_rule(g['e'], lambda d: None, ['d'])
+    with pytest.raises(ValueError) as context:
+        g.build()
+    message = str(context.value)
+    assert "cyclic" in message
+    path = message.split(': ')[1].split(' -> ')
+    assert len(path) == 5
+    assert path[0] == path[-1]
+    assert set(path) == set("bcde")
+    assert all(g[x].callbacks == [] for x in "abcde")
 
 
 def test_diamond_graph(mocker):
@@ -315,6 +514,462 @@ def test_diamond_graph(mocker):
         mocks[x].assert_called_once_with(graph[x])
 
 
+def test_propagation_order():
+    # Create graph
+    graph = Graph()
+    for x in "abcde":
+        graph.add_node(Node(x))
+    order = []
+
+    def rule(name):
+        def func(*nodes):
+            order.append(name)
+            return sum(node.result() for node in nodes)
+        return func
+
+    # Set the rules
+    graph.add_rule(graph['e'], rule('e'), ['a', 'd'])
+    graph.add_rule(graph['d'], rule('d'), ['c'])
+    graph.add_rule(graph['c'], rule('c'), ['b'])
+    graph.add_rule(graph['b'], rule('b'), ['a'])
+
+    # Build graph
+    graph.build()
+    assert graph._ranks == {
+        graph['b']: 1, graph['c']: 2, graph['d']: 3, graph['e']: 4}
+
+    # Subscriptions are stored as bitmasks of node indexes
+    ids = graph._ids
+    assert graph._subscriptions[ids[graph['a']]] == (
+        1 << ids[graph['b']] | 1 << ids[graph['e']])
+    assert graph.subscribers('a') == sorted(
+        [graph['b'], graph['e']], key=ids.get)
+    assert graph.subscribers('e') == []
+
+    # Each node is updated once, after all its dependencies
+    graph['a'].set_result(1)
+    assert order == ['b', 'c', 'd', 'e']
+    assert graph['e'].result() == 2
+    assert not graph._queue
+    assert not graph._pending
+
+
+def test_incremental_graph(mocker):
+    # Create graph
+    graph = Graph()
+    for x in "abc":
+        graph.add_node(Node(x))
+    graph.add_rule(graph['b'], lambda a: a.result() * 10, ['a'])
+    graph.build()
+    graph['a'].set_result(1)
+    assert graph['b'].result() == 10
+
+    # Add a node and a rule to the built graph
+    graph.add_node(Node('d'))
+    graph.add_rule(graph['c'], lambda b: b.result() + 1, ['b'])
+    assert graph['c'].result() == 11
+    assert graph._ranks[graph['c']] == 2
+    graph.add_rule(
+        graph['d'], lambda a, c: a.result() + c.result(), ['a', 'c'])
+    assert graph['d'].result() == 12
+    assert graph._ranks[graph['d']] == 3
+    graph['a'].set_result(2)
+    assert graph['d'].result() == 23
+
+    # Insert a rule upstream
+    graph.add_node(Node('e'))
+    graph.remove_rule(graph['b'])
+    assert graph['b'] not in graph._ranks
+    assert graph.subscribers('a') == [graph['d']]
+    graph.add_rule(graph['b'], lambda e: e.result(), ['e'])
+    assert graph._ranks == {
+        graph['b']: 1, graph['c']: 2, graph['d']: 3}
+    mock = mocker.Mock()
+    graph['d'].callbacks.append(mock)
+    graph['e'].set_result(5)
+    assert graph['c'].result() == 6
+    assert graph['d'].result() == 8
+    mock.assert_called_once_with(graph['d'])
+
+    # Cyclic dependency
+    with pytest.raises(ValueError) as context:
+        graph.add_rule(graph['e'], lambda d: d.result(), ['d'])
+    assert "e -> b -> c -> d -> e" in str(context.value)
+    assert graph['e'] not in graph._rules
+
+    # Remove nodes
+    with pytest.raises(ValueError) as context:
+        graph.remove_node(graph['c'])
+    assert "The node c is bound to d" in str(context.value)
+    graph.remove_node(graph['d'])
+    assert 'd' not in graph
+    graph.remove_node(graph['c'])
+    assert graph.callback not in graph['b'].callbacks
+    assert graph._ranks == {graph['b']: 1}
+    with pytest.raises(ValueError):
+        graph.remove_rule(graph['a'])
+
+
+def test_graph_transaction(mocker):
+    # Create graph
+    graph = Graph()
+    for x in "abcd":
+        graph.add_node(Node(x))
+    rule = mocker.Mock(side_effect=lambda *nodes: sum(
+        node.result() for node in nodes))
+    graph.add_rule(graph['c'], rule, ['a', 'b'])
+    graph.add_rule(graph['d'], lambda c: c.result() * 2, ['c'])
+    graph.build()
+
+    # Without transaction
+    graph['a'].set_result(1)
+    graph['b'].set_result(2)
+    assert rule.call_count == 2
+    assert graph['d'].result() == 6
+
+    # With nested transactions
+    rule.reset_mock()
+    with graph.transaction():
+        graph['a'].set_result(3)
+        with graph.transaction():
+            graph['b'].set_result(4)
+        assert graph['c'].result() == 3
+        assert not rule.called
+    rule.assert_called_once_with(graph['a'], graph['b'])
+    assert graph['d'].result() == 14
+
+    # Propagate on error
+    with pytest.raises(RuntimeError):
+        with graph.transaction():
+            graph['a'].set_result(5)
+            raise RuntimeError('Oops')
+    assert graph['d'].result() == 18
+
+
+def test_graph_transaction_with_changes(mocker):
+    # Create graph
+    graph = Graph(profiling=True)
+    for x in "abc":
+        graph.add_node(Node(x))
+    graph.add_rule(graph['b'], lambda a: a.result() * 2, ['a'])
+    graph.add_rule(graph['c'], lambda a: a.result() * 3, ['a'])
+    graph.build()
+    graph['a'].set_result(1)
+
+    # Replace a pending node (its index is reused)
+    with graph.transaction():
+        graph['a'].set_result(2)
+        graph.remove_node(graph['c'])
+        graph.add_node(Node('d'))
+        graph.add_rule(graph['d'], lambda a: a.result() + 1, ['a'])
+    assert graph['b'].result() == 4
+    assert graph['d'].result() == 3
+
+    # Rank a pending node again
+    rule = mocker.Mock(side_effect=lambda b: b.result() + 1)
+    with graph.transaction():
+        graph['a'].set_result(3)
+        graph.remove_rule(graph['d'])
+        graph.add_rule(graph['d'], rule, ['b'])
+        assert graph._ranks[graph['d']] == 2
+    rule.assert_called_once_with(graph['b'])
+    assert graph['d'].result() == 7
+
+    # No change during propagation
+    def remove(node):
+        with pytest.raises(RuntimeError):
+            graph.remove_rule(graph['d'])
+    graph['b'].callbacks.append(remove)
+    graph['a'].set_result(4)
+    assert graph['d'] in graph._rules
+    assert graph.profile()['d']['calls'] == 2
+    assert graph['d'].result() == 9
+
+
+def test_parallel_graph(mocker):
+    # Create graph
+    executor = ThreadPoolExecutor(2)
+    graph = Graph(executor=executor)
+    for x in "abcd":
+        graph.add_node(Node(x))
+    events = {x: threading.Event() for x in "bc"}
+
+    def rule(x, y):
+        def func(a):
+            # Both rules have to run at the same time
+            events[x].set()
+            assert events[y].wait(1.)
+            return a.result() * 10
+        return func
+
+    def fail(a):
+        raise RuntimeError('Ooops')
+
+    # Set the rules
+    graph.add_rule(graph['b'], rule('b', 'c'), ['a'])
+    graph.add_rule(graph['c'], rule('c', 'b'), ['a'])
+    graph.add_rule(graph['d'], fail, ['a'])
+    graph.build()
+
+    # Notifications are in a deterministic order
+    order = []
+    for x in "bcd":
+        graph[x].callbacks.append(lambda node: order.append(node.name))
+    graph['a'].set_result(1)
+    assert graph['b'].result() == 10
+    assert graph['c'].result() == 10
+    with pytest.raises(RuntimeError):
+        graph['d'].result()
+    assert order == sorted(order, key=lambda x: graph._ids[graph[x]])
+    assert len(order) == 3
+    executor.shutdown()
+
+
+def test_lazy_graph(mocker):
+    # Create graph
+    graph = Graph()
+    for x in "abcde":
+        graph.add_node(Node(x))
+    rules = {x: mocker.Mock(side_effect=lambda n: n.result() + 1)
+             for x in "bcde"}
+    graph.add_rule(graph['b'], rules['b'], ['a'], lazy=True)
+    graph.add_rule(graph['c'], rules['c'], ['b'], lazy=True)
+    graph.add_rule(graph['d'], rules['d'], ['c'], lazy=True)
+    graph.build()
+
+    # Nothing is computed
+    graph['a'].set_result(1)
+    for x in "bcd":
+        assert not rules[x].called
+        assert graph[x].result() is None
+    assert graph._dirty == {graph['b'], graph['c'], graph['d']}
+
+    # Pull a node
+    graph.evaluate(graph['c'])
+    assert graph['c'].result() == 3
+    assert graph['d'].result() is None
+    assert graph._dirty == {graph['d']}
+    rules['b'].assert_called_once_with(graph['a'])
+    rules['c'].assert_called_once_with(graph['b'])
+    graph.evaluate(graph['c'])
+    assert rules['c'].call_count == 1
+
+    # Observe a node
+    observed = mocker.Mock(return_value=True)
+    graph.observe(graph['d'], observed)
+    graph['a'].set_result(2)
+    assert graph['d'].result() == 5
+    assert [rules[x].call_count for x in "bcd"] == [2, 2, 1]
+    observed.return_value = False
+    graph['a'].set_result(3)
+    assert graph['d'].result() == 5
+    graph.unobserve(graph['d'])
+    graph['a'].set_result(4)
+    assert graph['d'].result() == 5
+    assert [rules[x].call_count for x in "bcd"] == [2, 2, 1]
+
+    # Eager subscriber
+    graph.add_rule(graph['e'], rules['e'], ['c'])
+    assert graph['e'].result() == 7
+    assert [rules[x].call_count for x in "bce"] == [3, 3, 1]
+    graph['a'].set_result(5)
+    assert graph['e'].result() == 8
+    assert rules['c'].call_count == 4
+    assert graph._dirty == {graph['d']}
+
+
+def test_parallel_lazy_graph(mocker):
+    # Create graph
+    executor = ThreadPoolExecutor(2)
+    graph = Graph(executor=executor)
+    for x in "alpq":
+        graph.add_node(Node(x))
+    order = []
+
+    def rule(name):
+        return lambda *nodes: order.append(name) or nodes[0].result()
+
+    graph.add_rule(graph['l'], rule('l'), ['a'], lazy=True)
+    graph.add_rule(graph['p'], rule('p'), ['l'])
+    graph.add_rule(graph['q'], rule('q'), ['l'])
+    graph.build()
+
+    # The batch pulls the lazy node once, and is computed once
+    graph['a'].set_result(1)
+    assert order[0] == 'l'
+    assert sorted(order[1:]) == ['p', 'q']
+    assert graph['q'].result() == 1
+    assert not graph._pending
+    executor.shutdown()
+
+
+def test_rate_limited_graph(mocker):
+    timer = mocker.patch('threading.Timer')
+    clock = mocker.Mock(return_value=0.)
+    a, b, c = Node('a'), Node('b'), Node('c')
+    func = mocker.Mock(side_effect=lambda a: a.result())
+    g = Graph()
+    g.clock = clock
+    for node in (a, b, c):
+        g.add_node(node)
+    g.add_rule(b, func, ['a'], min_interval=1.)
+    g.add_rule(c, lambda b: b.result(), ['b'])
+    g.build()
+    # First update goes through
+    a.set_result(1)
+    assert c.result() == 1
+    # Burst is coalesced
+    clock.return_value = 0.25
+    a.set_result(2)
+    clock.return_value = 0.5
+    a.set_result(3)
+    assert func.call_count == 1
+    assert c.result() == 1
+    assert b.counters['coalesced'] == 2
+    timer.assert_called_once_with(0.75, g._trailing_update, (b,))
+    # Trailing update with the latest value
+    clock.return_value = 1.
+    g._trailing_update(b)
+    assert func.call_count == 2
+    assert c.result() == 3
+    # Interval is over
+    clock.return_value = 2.5
+    a.set_result(4)
+    assert c.result() == 4
+    # Reset cancels the pending timer
+    clock.return_value = 3.
+    a.set_result(5)
+    g.reset()
+    timer.return_value.cancel.assert_called_once_with()
+    assert not g._timers
+    with pytest.raises(ValueError):
+        g.add_rule(Node('d'), func, ['a'], min_interval=-1)
+
+
+def test_graph_profile(mocker):
+    clock = mocker.Mock(side_effect=[0., 1., 1., 1.5, 2., 4., 4., 4.5])
+    a, b = Node('a'), Node('b')
+    g = Graph(profiling=True)
+    g.clock = clock
+    g.add_node(a)
+    g.add_node(b)
+    g.add_rule(b, lambda a: a.result(), ['a'])
+    g.build()
+    a.set_result(1)
+    a.set_result(2)
+    expected = {
+        'calls': 2, 'rule_time': 3., 'max_rule_time': 2.,
+        'notify_time': 1., 'waves': 2}
+    assert g.profile() == {'b': expected}
+    # Disabled
+    g.profiling = False
+    a.set_result(3)
+    assert g.profile()['b']['calls'] == 2
+    g.reset_profile()
+    assert g.profile() == {}
+
+
+def test_delta_graph(mocker):
+    nodes = [Node(name) for name in 'abc']
+    d = Node('d')
+    func = mocker.Mock(return_value=0)
+    g = Graph()
+    for node in nodes + [d]:
+        g.add_node(node)
+    g.add_rule(d, func, ['a', 'b', 'a', 'c'], delta=True)
+    g.build()
+    publishers = [nodes[0], nodes[1], nodes[0], nodes[2]]
+    nodes[0].set_result(1)
+    func.assert_called_once_with([0, 2], *publishers)
+    # Changes are merged in transactions
+    with g.transaction():
+        nodes[1].set_result(1)
+        nodes[2].set_result(1)
+    func.assert_called_with([1, 3], *publishers)
+    # Unknown changes
+    g.remove_rule(d)
+    g.add_rule(d, func, ['c', 'b'], delta=True)
+    func.assert_called_with([0, 1], nodes[2], nodes[1])
+    assert not g._changed
+
+
+def test_column_nodes(mocker):
+    columns = Columns(3)
+    nodes = [ColumnNode(str(i), columns, i) for i in range(3)]
+    # The columns are updated before the notification
+    callback = mocker.Mock(
+        side_effect=lambda node: callback.values.append(
+            columns.values.tolist()))
+    callback.values = []
+    nodes[0].callbacks.append(callback)
+    nodes[0].set_result(triplet(True, 1.))
+    nodes[1].set_result(triplet(2, 2., INVALID))
+    assert callback.values == [[1, 0, 0]]
+    assert columns.values.dtype == bool
+    assert columns.present.tolist() == [True, True, False]
+    assert columns.stamps.tolist() == [1., 2., 0.]
+    assert columns.qualities.tolist() == [int(VALID), int(INVALID), 0]
+    # Upcast
+    nodes[1].set_result(triplet(2, 2.))
+    assert columns.values.dtype.kind == 'i'
+    nodes[2].set_result(triplet(2.5, 3.))
+    assert columns.values.tolist() == [1., 2., 2.5]
+    # Reset without value
+    nodes[2].set_result(triplet(2.5, 3.5, INVALID))
+    assert columns.values.tolist() == [1., 2., 0.]
+    view = Columns.view(columns.values)
+    nodes[2].set_result(triplet([1, 2], 4.))
+    assert columns.values.dtype == object
+    assert view.tolist() == [1., 2., 0.]
+    nodes[1].set_result(triplet(None, 5., INVALID))
+    assert columns.values.tolist() == [1., None, [1, 2]]
+    # Exceptions
+    error = RuntimeError('Ooops')
+    nodes[1].set_exception(error)
+    assert columns.exception() is error
+    assert columns.present.tolist() == [True, False, True]
+    nodes[1].set_result(None)
+    assert columns.exception() is None
+    # Read-only views
+    view = columns.view(columns.stamps)
+    assert view.base is columns.stamps
+    with pytest.raises(ValueError):
+        view[0] = 1.
+
+
+def test_rule_cache(mocker):
+    func = mocker.Mock(side_effect=lambda *args: sum(args))
+    # Last values only
+    cache = RuleCache()
+    assert cache.call(func, (1, 2)) == 3
+    assert cache.call(func, (1, 2)) == 3
+    assert cache.call(func, (2, 2)) == 4
+    assert cache.call(func, (1, 2)) == 3
+    assert func.call_count == 3
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert cache.hit_rate == 0.25
+    # Arrays
+    func.reset_mock()
+    func.side_effect = lambda x: x.sum()
+    assert cache.call(func, [numpy.array([1, 2])]) == 3
+    assert cache.call(func, [numpy.array([1, 2])]) == 3
+    assert cache.call(func, [numpy.array([1, 3])]) == 4
+    assert func.call_count == 2
+    # LRU
+    func.reset_mock()
+    func.side_effect = lambda x: x * 2
+    cache = RuleCache(size=2)
+    for x in [1, 2, 1, 3, 2, 1, 1]:
+        assert cache.call(func, [x]) == x * 2
+    assert [c[0][0] for c in func.call_args_list] == [1, 2, 3, 2, 1]
+    assert list(cache._lru) == [(2,), (1,)]
+    # Unhashable values
+    assert cache.call(func, [[5]]) == [5, 5]
+    assert len(cache._lru) == 2
+    cache.clear()
+    assert not cache._lru
+
+
 def test_wrong_graph():
     g = Graph()
     g.add_node(Node('a'))
@@ -51,6 +51,64 @@ def test_local_attribute(mocker):
         on_a_mock.assert_called_once_with(*expected)
 
 
+def test_local_attribute_with_deadband(mocker):
+
+    class Test(Facade):
+
+        A = local_attribute(
+            dtype=float,
+            abs_change=1,
+            access=AttrWriteType.READ_WRITE)
+
+    change_events, archive_events = event_mock(mocker, Test)
+
+    mocker.patch('time.time').return_value = 1.0
+
+    with DeviceTestContext(Test) as proxy:
+        proxy.A = 10
+        proxy.A = 10.4
+        # The value is updated, but not pushed
+        assert proxy.A == 10.4
+        expected = 10, 1.0, AttrQuality.ATTR_VALID
+        change_events['A'].assert_called_once_with(*expected)
+        proxy.A = 11.5
+        assert proxy.A == 11.5
+        assert change_events['A'].call_count == 2
+
+
+def test_local_attribute_with_async_push(mocker):
+
+    class Test(Facade):
+
+        async_push = True
+
+        A = local_attribute(
+            dtype=float,
+            access=AttrWriteType.READ_WRITE)
+
+    change_events, archive_events = event_mock(mocker, Test)
+
+    time.time
+    mocker.patch('time.time').return_value = 1.0
+
+    with DeviceTestContext(Test) as proxy:
+        assert proxy.state() == DevState.UNKNOWN
+        proxy.A = 21
+        assert proxy.A == 21
+        # Pushed from the pusher thread
+        for _ in range(50):
+            if archive_events['A'].called:
+                break
+            time.sleep(0.1)
+        expected = 21, 1.0, AttrQuality.ATTR_VALID
+        change_events['A'].assert_called_once_with(*expected)
+        archive_events['A'].assert_called_once_with(*expected)
+        # Check info
+        info = proxy.getinfo()
+        assert "Event push statistics:" in info
+        assert " - events: 1 pushed, 0 conflated" in info
+
+
 def test_local_attribute_callback_error(mocker):
 
     class Test(Facade):
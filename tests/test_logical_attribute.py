@@ -2,7 +2,10 @@
 
 # Imports
 import time
+import json
 import pytest
+import threading
+from contextlib import contextmanager
 
 from tango.server import command
 from tango.test_context import DeviceTestContext
@@ -10,7 +13,7 @@ from tango import AttrQuality, DevState
 from tango import AttrWriteType, DevFailed
 
 # Proxy imports
-from facadedevice import Facade, triplet
+from facadedevice import Facade, triplet, device
 from facadedevice import local_attribute, logical_attribute
 
 # Local imports
@@ -113,6 +116,261 @@ def test_diamond_attribute(mocker):
         archive_events['D'].assert_called_once_with(*expected)
 
 
+def test_memoized_logical_attribute(mocker):
+
+    class Test(Facade):
+
+        @logical_attribute(
+            dtype=float,
+            bind=['A', 'B'],
+            memoize=True)
+        def C(self, a, b):
+            rule_mock(a, b)
+            return a/b
+
+        A = local_attribute(
+            dtype=float,
+            access=AttrWriteType.READ_WRITE)
+
+        B = local_attribute(
+            dtype=float,
+            access=AttrWriteType.READ_WRITE)
+
+    rule_mock = mocker.Mock()
+    change_events, archive_events = event_mock(mocker, Test)
+    time_mock = mocker.patch('time.time')
+    time_mock.return_value = 1.0
+
+    with DeviceTestContext(Test) as proxy:
+        proxy.A = 21
+        proxy.B = 7
+        assert proxy.C == 3
+        rule_mock.assert_called_once_with(21, 7)
+        # Same values, new stamp
+        time_mock.return_value = 2.0
+        proxy.A = 21
+        assert proxy.C == 3
+        rule_mock.assert_called_once_with(21, 7)
+        expected = 3.0, 2.0, AttrQuality.ATTR_VALID
+        change_events['C'].assert_called_with(*expected)
+        # Check info
+        info = proxy.GetInfo()
+        assert "C: 1 hit(s), 1 miss(es) (50.0% hit rate)" in info
+
+
+def test_lazy_logical_attribute(mocker):
+
+    class Test(Facade):
+
+        A = local_attribute(
+            dtype=float,
+            access=AttrWriteType.READ_WRITE)
+
+        @logical_attribute(
+            bind=['A'],
+            create_attribute=False,
+            lazy=True)
+        def B(self, a):
+            rule_mock('B')
+            return a * 10
+
+        @logical_attribute(
+            dtype=float,
+            bind=['B'],
+            lazy=True)
+        def C(self, b):
+            rule_mock('C')
+            return b + 1
+
+    rule_mock = mocker.Mock()
+    change_events, archive_events = event_mock(mocker, Test)
+    mocker.patch('time.time').return_value = 1.0
+
+    with DeviceTestContext(Test) as proxy:
+        proxy.A = 2
+        proxy.A = 3
+        assert not rule_mock.called
+        assert not change_events['C'].called
+        # Read the attribute
+        assert proxy.C == 31
+        assert rule_mock.call_args_list == [
+            mocker.call('B'), mocker.call('C')]
+        assert proxy.C == 31
+        assert rule_mock.call_count == 2
+
+
+def test_rate_limited_logical_attribute(mocker):
+
+    class Test(Facade):
+
+        A = local_attribute(
+            dtype=float,
+            access=AttrWriteType.READ_WRITE)
+
+        @logical_attribute(
+            dtype=float,
+            bind=['A'],
+            max_rate=0.1)
+        def B(self, a):
+            return a * 10
+
+    change_events, archive_events = event_mock(mocker, Test)
+    mocker.patch('time.time').return_value = 1.0
+
+    with DeviceTestContext(Test) as proxy:
+        proxy.A = 2
+        assert proxy.B == 20
+        # Coalesced until the trailing update
+        proxy.A = 3
+        assert proxy.B == 20
+        expected = 20., 1.0, AttrQuality.ATTR_VALID
+        change_events['B'].assert_called_once_with(*expected)
+        info = proxy.getinfo()
+        assert " - B: 1 coalesced" in info
+
+
+def test_rate_limited_trailing_update(mocker):
+
+    class Test(Facade):
+
+        A = local_attribute(
+            dtype=float,
+            access=AttrWriteType.READ_WRITE)
+
+        @logical_attribute(
+            dtype=float,
+            bind=['A'],
+            min_interval=0.2)
+        def B(self, a):
+            calls.append((threading.current_thread(), bool(locked)))
+            return a * 10
+
+    # Spy on the device monitor
+    calls, locked = [], []
+    monitor = device.AutoTangoMonitor
+
+    @contextmanager
+    def spy_monitor(dev):
+        with monitor(dev):
+            locked.append(True)
+            try:
+                yield
+            finally:
+                locked.pop()
+
+    mocker.patch('facadedevice.device.AutoTangoMonitor', spy_monitor)
+    change_events, archive_events = event_mock(mocker, Test)
+    mocker.patch('time.time').return_value = 1.0
+
+    with DeviceTestContext(Test) as proxy:
+        proxy.A = 2
+        proxy.A = 3
+        assert proxy.B == 20
+        # Let the trailing timer fire
+        for _ in range(50):
+            if change_events['B'].call_count == 2:
+                break
+            time.sleep(0.1)
+        expected = 30., 1.0, AttrQuality.ATTR_VALID
+        change_events['B'].assert_called_with(*expected)
+        assert proxy.B == 30
+        # The trailing update ran in the timer thread, under the monitor
+        thread, under_monitor = calls[-1]
+        assert thread is not threading.current_thread()
+        assert under_monitor
+
+
+def test_profiled_logical_attribute(mocker):
+
+    class Test(Facade):
+
+        graph_profiling = True
+
+        A = local_attribute(
+            dtype=float,
+            access=AttrWriteType.READ_WRITE)
+
+        @logical_attribute(
+            dtype=float,
+            bind=['A'],
+            memoize=True)
+        def B(self, a):
+            return a * 10
+
+    change_events, archive_events = event_mock(mocker, Test)
+    mocker.patch('time.time').return_value = 1.0
+
+    with DeviceTestContext(Test) as proxy:
+        proxy.A = 2
+        proxy.A = 3
+        profile = json.loads(proxy.GetProfile())
+        assert profile['enabled']
+        stats = profile['nodes']['B']
+        assert stats['calls'] == 2
+        assert stats['waves'] == 2
+        assert stats['max_rule_time'] <= stats['rule_time']
+        assert stats['cache'] == {'hits': 0, 'misses': 2}
+        assert 'A' not in profile['nodes']
+
+
+def test_memoized_custom_aggregation():
+
+    with pytest.raises(ValueError) as ctx:
+
+        class Test(Facade):
+
+            @logical_attribute(
+                bind=['A'],
+                standard_aggregation=False,
+                memoize=True)
+            def C(self, a):
+                pass
+
+    assert "requires the standard aggregation" in str(ctx.value)
+
+
+def test_parallel_diamond_attribute(mocker):
+
+    class Test(Facade):
+
+        graph_workers = 2
+
+        A = local_attribute(
+            dtype=float,
+            access=AttrWriteType.READ_WRITE)
+
+        @logical_attribute(
+            dtype=float,
+            bind=['A'])
+        def B(self, a):
+            return a*10
+
+        @logical_attribute(
+            dtype=float,
+            bind=['A'])
+        def C(self, a):
+            return a*100
+
+        @logical_attribute(
+            dtype=float,
+            bind=['A', 'B', 'C'])
+        def D(self, a, b, c):
+            return a + b + c
+
+    change_events, archive_events = event_mock(mocker, Test)
+    mocker.patch('time.time').return_value = 1.0
+
+    with DeviceTestContext(Test) as proxy:
+        proxy.A = 7
+        assert proxy.B == 70
+        assert proxy.C == 700
+        assert proxy.D == 777
+        # Check events
+        expected = 777., 1.0, AttrQuality.ATTR_VALID
+        change_events['D'].assert_called_once_with(*expected)
+        archive_events['D'].assert_called_once_with(*expected)
+
+
 def test_logical_attribute_with_exception(mocker):
 
     class Test(Facade):
@@ -2,15 +2,18 @@
 
 # Imports
 import pytest
+import threading
 
 # Tango imports
 from tango.server import command
 from tango.test_context import DeviceTestContext
 from tango import DevState, EventType, EventData, AttrQuality
-from tango import AttrWriteType, DevFailed
+from tango import AttrWriteType, DevFailed, Except
+from tango import AttrDataFormat, CmdArgType
 
 # Facade imports
-from facadedevice import Facade, proxy_attribute, utils
+from facadedevice import Facade, proxy_attribute, state_attribute, utils
+from facadedevice.graph import Graph, Node
 
 # Local imports
 from test_simple import event_mock
@@ -35,7 +38,7 @@ def test_proxy_attribute(mocker):
         # Device not in fault
         assert proxy.state() == DevState.UNKNOWN
         # Check mocks
-        utils.DeviceProxy.assert_called_with('a/b/c')
+        utils.DeviceProxy.assert_called_once_with('a/b/c')
         assert subscribe_event.called
         cb = subscribe_event.call_args[0][2]
         args = 'd', EventType.CHANGE_EVENT, cb, [], False
@@ -65,6 +68,312 @@ def test_proxy_attribute(mocker):
         assert proxy.state() == DevState.UNKNOWN
 
 
+def test_proxy_attribute_with_duplicate_errors(mocker):
+
+    class Test(Facade):
+
+        attr = proxy_attribute(
+            dtype=float,
+            property_name='prop')
+
+    change_events, archive_events = event_mock(mocker, Test)
+
+    mocker.patch('facadedevice.utils.DeviceProxy')
+    inner_proxy = utils.DeviceProxy.return_value
+    inner_proxy.dev_name.return_value = 'a/b/c'
+    subscribe_event = inner_proxy.subscribe_event
+
+    with DeviceTestContext(Test, properties={'prop': 'a/b/c/d'}) as proxy:
+        cb = subscribe_event.call_args[0][2]
+        # Trigger the same error twice
+        for _ in range(2):
+            try:
+                Except.throw_exception('Reason', 'Device is dead', 'origin')
+            except DevFailed as exc:
+                event = mocker.Mock(spec=EventData)
+                event.attr_name = 'a/b/c/d'
+                event.errors = exc.args
+                cb(event)
+        # Check events
+        assert change_events['attr'].call_count == 1
+        assert archive_events['attr'].call_count == 1
+        # Check info
+        info = proxy.getinfo()
+        assert " - attr: 1 duplicate_exceptions" in info
+
+
+def test_subscription_registry(mocker):
+    registry = utils.SubscriptionRegistry()
+    proxy = mocker.Mock()
+    callbacks = [mocker.Mock() for _ in range(3)]
+    args = 'a/b/c', proxy, 'd', EventType.CHANGE_EVENT
+    # First subscription
+    token1 = registry.subscribe(*args, callback=callbacks[0])
+    assert proxy.subscribe_event.call_count == 1
+    dispatch = proxy.subscribe_event.call_args[0][2]
+    event = mocker.Mock()
+    dispatch(event)
+    callbacks[0].assert_called_once_with(event)
+    # Shared subscription replays the last event
+    token2 = registry.subscribe(*args, callback=callbacks[1])
+    callbacks[1].assert_called_once_with(event)
+    assert registry.count(token1) == 2
+    # Different key
+    args = 'A/B/C', proxy, 'e', EventType.CHANGE_EVENT
+    token3 = registry.subscribe(*args, callback=callbacks[2])
+    assert proxy.subscribe_event.call_count == 2
+    assert not callbacks[2].called
+    # Fan out
+    event = mocker.Mock()
+    dispatch(event)
+    callbacks[0].assert_called_with(event)
+    callbacks[1].assert_called_with(event)
+    assert not callbacks[2].called
+    # Reference counted unsubscription
+    registry.unsubscribe(token1)
+    assert not proxy.unsubscribe_event.called
+    registry.unsubscribe(token2)
+    registry.unsubscribe(token3)
+    assert proxy.unsubscribe_event.call_count == 2
+    # Subscription failure
+    proxy.subscribe_event.side_effect = DevFailed
+    with pytest.raises(DevFailed):
+        registry.subscribe(*args, callback=callbacks[2])
+    assert not registry._entries
+
+
+def test_subscription_registry_concurrency(mocker):
+    registry = utils.SubscriptionRegistry()
+    release = threading.Event()
+    slow, fast = mocker.Mock(), mocker.Mock()
+    slow.subscribe_event.side_effect = lambda *args: release.wait(5) and 1
+    fast.subscribe_event.return_value = 2
+    callbacks = [mocker.Mock() for _ in range(3)]
+    args = 'a/b/c', slow, 'd', EventType.CHANGE_EVENT
+    threads = [
+        threading.Thread(
+            target=registry.subscribe, args=args + (callbacks[i],))
+        for i in range(2)]
+    for thread in threads:
+        thread.start()
+    # Other subscriptions and events are not blocked
+    args = 'e/f/g', fast, 'h', EventType.CHANGE_EVENT
+    token = registry.subscribe(*args, callback=callbacks[2])
+    dispatch = fast.subscribe_event.call_args[0][2]
+    event = mocker.Mock()
+    dispatch(event)
+    callbacks[2].assert_called_once_with(event)
+    assert not release.is_set()
+    # The pending subscription is shared
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert slow.subscribe_event.call_count == 1
+    registry.unsubscribe(token)
+    fast.unsubscribe_event.assert_called_once_with(2)
+
+
+def test_subscription_registry_replay_order(mocker):
+    registry = utils.SubscriptionRegistry()
+    proxy = mocker.Mock()
+    args = 'a/b/c', proxy, 'd', EventType.CHANGE_EVENT
+    registry.subscribe(*args, callback=mocker.Mock())
+    dispatch = proxy.subscribe_event.call_args[0][2]
+    dispatch('old')
+    # A new event is dispatched between the registration and the replay
+    lock, hooks = registry._lock, []
+
+    class HookedLock(object):
+
+        def __enter__(self):
+            lock.acquire()
+
+        def __exit__(self, *args):
+            lock.release()
+            while hooks:
+                hooks.pop()()
+
+    registry._lock = HookedLock()
+    hooks.append(lambda: dispatch('new'))
+    received = []
+    registry.subscribe(*args, callback=received.append)
+    assert received == ['new']
+    dispatch('newer')
+    assert received == ['new', 'newer']
+
+
+def test_proxy_pool(mocker):
+    mocker.patch('facadedevice.utils.DeviceProxy')
+    pool = utils.ProxyPool(max_idle=10)
+    pool.clock = mocker.Mock(return_value=0.)
+    # Shared proxies
+    proxy = pool.get('a/b/c')
+    assert pool.get('A/B/C') is proxy
+    utils.DeviceProxy.assert_called_once_with('a/b/c')
+    proxy._get_info_.assert_called_once_with()
+    pool.get('e/f/g')
+    assert len(pool) == 2
+    # Idle eviction
+    pool.clock.return_value = 5.
+    pool.get('a/b/c')
+    pool.clock.return_value = 12.
+    pool.get('a/b/c')
+    assert len(pool) == 1
+    pool.clock.return_value = 30.
+    pool.get('e/f/g')
+    assert utils.DeviceProxy.call_count == 3
+    pool.clear()
+    assert not len(pool)
+    # Connection failure
+    utils.DeviceProxy.side_effect = DevFailed
+    with pytest.raises(DevFailed):
+        pool.get('a/b/c')
+    assert not len(pool)
+    assert not pool._connections
+
+
+def test_conflating_queue():
+    queue = utils.ConflatingQueue(maxsize=2)
+    assert queue.put('a', 1)
+    assert queue.put('b', 2)
+    assert queue.put('a', 3)
+    assert not queue.put('c', 4)
+    assert queue.put('c', 5)
+    assert len(queue) == 3
+    assert queue.get_batch() == [('a', 3), ('b', 2), ('c', 5)]
+    assert not len(queue)
+    assert queue.max_depth == 3
+    assert queue.counters == {'conflated': 2, 'overflow': 1, 'batches': 1}
+    # Close
+    thread = threading.Thread(target=queue.close)
+    thread.start()
+    assert queue.get_batch() is None
+    thread.join()
+
+
+def test_conflating_queue_overload(mocker):
+    queue = utils.ConflatingQueue(shed_threshold=4, shed_priority=1)
+    queue.clock = mocker.Mock(return_value=10.)
+    # Round-robin across sources, high priority first
+    for key in ['a1', 'a2', 'a3', 'b1']:
+        queue.put(key, key.upper(), source=key[0])
+    queue.put('s1', 'S1', priority=1, source='s')
+    assert queue.episode['peak'] == 5
+    assert queue.get_batch(2) == [('s1', 'S1'), ('a1', 'A1')]
+    # Overloaded: low priority events are shed
+    assert queue.put('c1', 'C1', source='c')
+    assert queue.put('c1', 'C2', source='c')
+    assert queue.put('s2', 'S2', priority=1, source='s')
+    assert (len(queue), queue.shed()) == (4, 1)
+    # End of the overload
+    queue.clock.return_value = 12.
+    assert queue.get_batch(2) == [('s2', 'S2'), ('b1', 'B1')]
+    assert queue.episode is None
+    assert queue.episodes[0] == {
+        'start': 10., 'duration': 2., 'peak': 5, 'shed': 2}
+    assert queue.get_batch() == [('a2', 'A2'), ('c1', 'C2'), ('a3', 'A3')]
+    assert queue.counters['shed'] == 2
+    assert queue.counters['overloads'] == 1
+
+
+def test_event_priorities(mocker):
+
+    class Test(Facade):
+
+        event_queue_size = 10
+
+        attr = proxy_attribute(
+            dtype=float,
+            property_name='prop')
+
+        other = proxy_attribute(
+            dtype=float,
+            property_name='other_prop')
+
+        @state_attribute(bind=['attr'])
+        def state(self, attr):
+            return DevState.ON
+
+        @command(dtype_out=str)
+        def priorities(self):
+            return '{} {}'.format(
+                self.graph['attr'].priority, self.graph['other'].priority)
+
+    change_events, archive_events = event_mock(mocker, Test)
+
+    mocker.patch('facadedevice.utils.DeviceProxy')
+    inner_proxy = utils.DeviceProxy.return_value
+    inner_proxy.dev_name.return_value = 'a/b/c'
+
+    props = {'prop': 'a/b/c/d', 'other_prop': 'a/b/c/e'}
+    with DeviceTestContext(Test, properties=props) as proxy:
+        assert proxy.priorities() == '1 0'
+
+
+def test_deep_event_priorities(mocker):
+    graph = Graph()
+    for i in range(3000):
+        graph.add_node(Node(str(i)))
+        if i:
+            graph.add_rule(graph[str(i)], lambda node: None, [str(i - 1)])
+    graph['2999'].priority = 2
+    graph['10'].priority = 1
+    graph.build()
+    device = mocker.Mock(_graph=graph)
+    Facade.__dict__['_set_priorities'](device)
+    assert graph['0'].priority == graph['2998'].priority == 2
+    # Only for the event queue
+    graph['0'].priority = 0
+    device._event_queue = None
+    Facade.__dict__['_set_priorities'](device)
+    assert graph['0'].priority == 0
+
+
+def test_proxy_attribute_with_event_queue(mocker):
+
+    class Test(Facade):
+
+        event_queue_size = 10
+
+        attr = proxy_attribute(
+            dtype=float,
+            property_name='prop')
+
+    change_events, archive_events = event_mock(mocker, Test)
+
+    mocker.patch('facadedevice.utils.DeviceProxy')
+    inner_proxy = utils.DeviceProxy.return_value
+    inner_proxy.dev_name.return_value = 'a/b/c'
+    subscribe_event = inner_proxy.subscribe_event
+
+    with DeviceTestContext(Test, properties={'prop': 'a/b/c/d'}) as proxy:
+        assert proxy.state() == DevState.UNKNOWN
+        cb = subscribe_event.call_args[0][2]
+        # Trigger events
+        event = mocker.Mock(spec=EventData)
+        event.attr_name = 'a/b/c/d'
+        event.errors = False
+        event.attr_value.value = 1.2
+        event.attr_value.time.totime.return_value = 3.4
+        event.attr_value.quality = AttrQuality.ATTR_VALID
+        cb(event)
+        # Processed by the queue thread
+        expected = 1.2, 3.4, AttrQuality.ATTR_VALID
+        for _ in range(50):
+            if change_events['attr'].called:
+                break
+            threading.Event().wait(0.1)
+        change_events['attr'].assert_called_once_with(*expected)
+        assert proxy.attr == 1.2
+        # Check info
+        info = proxy.getinfo()
+        assert " - depth: 0 (peak 1, limit 10)" in info
+        assert " - events: 1 batches, 0 conflated, 0 overflow" in info
+        # Check delete + init device
+        proxy.init()
+        assert proxy.state() == DevState.UNKNOWN
+
+
 def test_proxy_attribute_with_convertion(mocker):
 
     class Test(Facade):
@@ -369,6 +678,288 @@ def test_non_writable_proxy_attribute(mocker):
         assert "The attribute a/b/c/d is not writable" in proxy.status()
 
 
+def test_concurrent_remote_checks(mocker):
+
+    class Test(Facade):
+
+        remote_check_timeout = 5.
+
+        attr1 = proxy_attribute(
+            dtype=float,
+            property_name='prop1')
+
+        attr2 = proxy_attribute(
+            dtype=float,
+            property_name='prop2')
+
+    change_events, archive_events = event_mock(mocker, Test)
+
+    # Both checks have to run at the same time
+    condition = threading.Condition()
+    arrived = []
+
+    def get_attribute_config(attr):
+        with condition:
+            arrived.append(attr)
+            condition.notify_all()
+            while len(arrived) < 2:
+                condition.wait(2)
+                if len(arrived) < 2:
+                    raise RuntimeError('Not concurrent')
+        return len(arrived)
+
+    mocker.patch('facadedevice.utils.DeviceProxy')
+    inner_proxy = utils.DeviceProxy.return_value
+    inner_proxy.get_attribute_config.side_effect = get_attribute_config
+    inner_proxy.dev_name.return_value = 'a/b/c'
+
+    props = {'prop1': 'a/b/c/d', 'prop2': 'e/f/g/h'}
+    with DeviceTestContext(Test, properties=props) as proxy:
+        assert proxy.state() == DevState.UNKNOWN
+        assert inner_proxy.get_attribute_config.call_count == 2
+
+
+def test_shared_remote_device(mocker):
+
+    class Test(Facade):
+
+        attr1 = proxy_attribute(
+            dtype=float,
+            property_name='prop1')
+
+        attr2 = proxy_attribute(
+            dtype=float,
+            property_name='prop2')
+
+        attr3 = proxy_attribute(
+            dtype=float,
+            property_name='prop3')
+
+        attr4 = proxy_attribute(
+            dtype=float,
+            property_name='prop4')
+
+    change_events, archive_events = event_mock(mocker, Test)
+
+    # Slow connection, for the concurrent checks to request it together
+    connected = threading.Event()
+    mocker.patch('facadedevice.utils.DeviceProxy')
+    inner_proxy = utils.DeviceProxy.return_value
+    utils.DeviceProxy.side_effect = \
+        lambda name: connected.wait(0.2) or inner_proxy
+    inner_proxy.dev_name.return_value = 'a/b/c'
+
+    props = {
+        'prop1': 'a/b/c/d', 'prop2': 'a/b/c/e',
+        'prop3': 'a/b/c/f', 'prop4': 'a/b/c/g'}
+    with DeviceTestContext(Test, properties=props) as proxy:
+        assert proxy.state() == DevState.UNKNOWN
+        assert inner_proxy.get_attribute_config.call_count == 4
+        # A single connection to the remote device
+        utils.DeviceProxy.assert_called_once_with('a/b/c')
+        inner_proxy._get_info_.assert_called_once_with()
+
+
+def test_remote_check_timeout(mocker):
+
+    class Test(Facade):
+
+        remote_check_timeout = 0.1
+
+        attr = proxy_attribute(
+            dtype=float,
+            property_name='prop')
+
+    change_events, archive_events = event_mock(mocker, Test)
+
+    event = threading.Event()
+    mocker.patch('facadedevice.utils.DeviceProxy')
+    inner_proxy = utils.DeviceProxy.return_value
+    inner_proxy.get_attribute_config.side_effect = lambda attr: event.wait(5)
+    inner_proxy.dev_name.return_value = 'a/b/c'
+
+    with DeviceTestContext(Test, properties={'prop': 'a/b/c/d'}) as proxy:
+        event.set()
+        assert proxy.state() == DevState.FAULT
+        assert "Exception while configuring" in proxy.status()
+        assert "timed out after 0.1 seconds" in proxy.status()
+
+
+def test_background_subscription(mocker):
+
+    class Test(Facade):
+
+        subscription_workers = 2
+        subscription_retry_period = 0.05
+
+        attr = proxy_attribute(
+            dtype=float,
+            property_name='prop')
+
+    change_events, archive_events = event_mock(mocker, Test)
+
+    # Fail twice (change and periodic events), then wait
+    event = threading.Event()
+    failures = [DevFailed(), DevFailed()]
+
+    def subscribe(*args):
+        if failures:
+            raise failures.pop()
+        event.wait(5)
+        return 1
+
+    mocker.patch('facadedevice.utils.DeviceProxy')
+    inner_proxy = utils.DeviceProxy.return_value
+    inner_proxy.dev_name.return_value = 'a/b/c'
+    inner_proxy.subscribe_event.side_effect = subscribe
+
+    def wait_for_info(text):
+        for _ in range(50):
+            info = proxy.getinfo()
+            if text in info:
+                return info
+            threading.Event().wait(0.1)
+        assert text in info
+
+    with DeviceTestContext(Test, properties={'prop': 'a/b/c/d'}) as proxy:
+        # Available straight away
+        assert proxy.state() == DevState.UNKNOWN
+        info = wait_for_info("- a/b/c/d: retrying every 0.05 seconds")
+        assert "Exception while subscribing to a/b/c/d" in info
+        # Successful retry
+        event.set()
+        info = wait_for_info("- a/b/c/d (CHANGE_EVENT)")
+        assert "Pending subscriptions" not in info
+        assert proxy.state() == DevState.UNKNOWN
+        # Check delete + init device
+        proxy.init()
+        assert proxy.state() == DevState.UNKNOWN
+        wait_for_info("- a/b/c/d (CHANGE_EVENT)")
+
+
+def test_parallel_background_subscription(mocker):
+
+    class Test(Facade):
+
+        subscription_workers = 2
+
+        attr1 = proxy_attribute(
+            dtype=float,
+            property_name='prop1')
+
+        attr2 = proxy_attribute(
+            dtype=float,
+            property_name='prop2')
+
+    change_events, archive_events = event_mock(mocker, Test)
+
+    # Both subscriptions have to run at the same time
+    condition = threading.Condition()
+    arrived = []
+
+    def subscribe(*args):
+        with condition:
+            arrived.append(args[0])
+            condition.notify_all()
+            while len(arrived) < 2:
+                condition.wait(5)
+                if len(arrived) < 2:
+                    raise RuntimeError('Not concurrent')
+        return len(arrived)
+
+    mocker.patch('facadedevice.utils.DeviceProxy')
+    inner_proxy = utils.DeviceProxy.return_value
+    inner_proxy.dev_name.return_value = 'a/b/c'
+    inner_proxy.subscribe_event.side_effect = subscribe
+
+    props = {'prop1': 'a/b/c/d', 'prop2': 'e/f/g/h'}
+    with DeviceTestContext(Test, properties=props) as proxy:
+        assert proxy.state() == DevState.UNKNOWN
+        for _ in range(50):
+            info = proxy.getinfo()
+            if info.count("(CHANGE_EVENT)") == 2:
+                break
+            threading.Event().wait(0.1)
+        assert info.count("(CHANGE_EVENT)") == 2
+        assert "Pending subscriptions" not in info
+        assert sorted(arrived) == ['d', 'h']
+
+
+def test_remote_cache_file(mocker, tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    cache = utils.RemoteCache(path, ttl=10)
+    cache.clock = mocker.Mock(return_value=0.)
+    cache.set('key', ['a', 'b'])
+    assert cache.get('key') == ['a', 'b']
+    cache.save()
+    assert tmpdir.listdir() == [tmpdir.join('cache.json')]
+    # Load from file
+    other = utils.RemoteCache(path, ttl=10)
+    other.clock = mocker.Mock(return_value=5.)
+    assert other.get('key') == ['a', 'b']
+    # Expired entry
+    other.clock.return_value = 20.
+    assert other.get('key') is None
+    # Version mismatch
+    mocker.patch.object(utils.RemoteCache, 'version', 2)
+    assert not len(utils.RemoteCache(path))
+
+
+def test_remote_cache(mocker, tmpdir):
+
+    class Test(Facade):
+
+        attr = proxy_attribute(
+            dtype=float,
+            property_name='prop')
+
+    Test.remote_cache_path = str(tmpdir.join('cache.json'))
+    change_events, archive_events = event_mock(mocker, Test)
+
+    mocker.patch('facadedevice.utils.DeviceProxy')
+    inner_proxy = utils.DeviceProxy.return_value
+    config = mocker.Mock(
+        writable=AttrWriteType.READ,
+        data_type=CmdArgType.DevDouble,
+        data_format=AttrDataFormat.SCALAR)
+    config.name = 'd'
+    inner_proxy.get_attribute_config.return_value = config
+    inner_proxy.dev_name.return_value = 'a/b/c'
+
+    with DeviceTestContext(Test, properties={'prop': 'a/b/c/d'}) as proxy:
+        # Fill the cache
+        assert proxy.state() == DevState.UNKNOWN
+        assert "- 1 miss(es)" in proxy.getinfo()
+        assert 'attribute:a/b/c/d' in tmpdir.join('cache.json').read()
+        # Start from the cache, and check it in the background
+        event = threading.Event()
+        inner_proxy.get_attribute_config.side_effect = \
+            lambda attr: event.wait(5) and config
+        proxy.init()
+        assert proxy.state() == DevState.UNKNOWN
+        assert "- 1 hit(s)" in proxy.getinfo()
+        event.set()
+        # Outdated config
+        outdated = mocker.Mock(
+            writable=AttrWriteType.READ_WRITE,
+            data_type=CmdArgType.DevDouble,
+            data_format=AttrDataFormat.SCALAR)
+        outdated.name = 'd'
+        inner_proxy.get_attribute_config.side_effect = None
+        inner_proxy.get_attribute_config.return_value = outdated
+        proxy.init()
+        for _ in range(50):
+            if proxy.state() == DevState.FAULT:
+                break
+            threading.Event().wait(0.1)
+        assert proxy.state() == DevState.FAULT
+        assert "attribute:a/b/c/d is outdated" in proxy.status()
+        assert "run Init" in proxy.status()
+        # The cache has been updated
+        proxy.init()
+        assert proxy.state() == DevState.UNKNOWN
+
+
 def test_missing_property():
 
     class Test(Facade):
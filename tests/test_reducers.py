@@ -0,0 +1,138 @@
+"""Contain the tests for the incremental reducers."""
+
+# Imports
+import numpy
+import pytest
+
+# Facade imports
+from facadedevice.graph import Node, triplet, VALID, INVALID
+from facadedevice.reducers import Reducer, Reduction, DeltaReducer
+from facadedevice.reducers import Sum, Mean, Count, Any, All, Min, Max
+from facadedevice.reducers import make_reducer
+
+# Tango imports
+from tango import AttrQuality
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('sum', 6), ('mean', 2.), ('count', 2),
+    ('min', 0), ('max', 4), ('any', True), ('all', False)])
+def test_reducers(name, expected):
+    reducer = make_reducer(name)
+    for index, value in enumerate([1, 2, 3]):
+        reducer.update(index, value)
+    reducer.update(0, 0)
+    reducer.update(2, 4)
+    reducer.update(3, 1)
+    reducer.update(3, None)
+    assert reducer.result() == expected
+
+
+def test_heap_reducers():
+    minimum, maximum = Min(), Max()
+    for reducer in (minimum, maximum):
+        for step in range(100):
+            reducer.update(step % 10, step)
+    assert minimum.result() == 90
+    assert maximum.result() == 99
+    assert len(minimum.heap) <= 2 * 10 + 16
+    minimum.update(0, None)
+    assert minimum.result() == 91
+    with pytest.raises(ValueError):
+        Max().result()
+
+
+def test_heap_reducers_ordering():
+    minimum, maximum = Min(), Max()
+    for reducer in (minimum, maximum):
+        for index, value in enumerate(['abc', 'zzz', 'b', 'zzz']):
+            reducer.update(index, value)
+    assert minimum.result() == 'abc'
+    assert maximum.result() == 'zzz'
+    maximum.update(1, None)
+    maximum.update(3, 'a')
+    assert maximum.result() == 'b'
+    # Arrays can't be ordered
+    with pytest.raises(TypeError):
+        minimum.update(4, numpy.arange(3))
+    minimum.update(4, None)
+    assert minimum.result() == 'abc'
+
+
+def test_sum_drift():
+    reducer = Sum()
+    for step in range(10):
+        reducer.update(0, 0.1 * step)
+        reducer.update(1, 1e16)
+        assert reducer.result() == 1e16
+        reducer.update(1, None)
+        assert reducer.result() == 0.1 * step
+    assert isinstance(make_reducer(Mean), Mean)
+    assert isinstance(make_reducer(Count), Reducer)
+    for value in ('median', None, Node):
+        with pytest.raises(ValueError):
+            make_reducer(value)
+
+
+def test_boolean_reducers():
+    reducers = Count(), Any(), All()
+    for reducer in reducers:
+        reducer.update(0, True)
+        reducer.update(1, True)
+    assert [r.result() for r in reducers] == [2, True, True]
+    for reducer in reducers:
+        reducer.update(1, False)
+    assert [r.result() for r in reducers] == [1, True, False]
+
+
+def test_delta_reducer(mocker):
+    func = mocker.Mock(return_value=3)
+    reducer = DeltaReducer(func)
+    reducer.update(0, 1)
+    reducer.update(1, 2)
+    assert reducer.result() == 3
+    func.assert_called_once_with({0: 1, 1: 2})
+    # Failure keeps the changes
+    func.side_effect = RuntimeError
+    reducer.update(1, None)
+    with pytest.raises(RuntimeError):
+        reducer.result()
+    func.side_effect = None
+    reducer.update(0, 5)
+    reducer.result()
+    func.assert_called_with({0: 5, 1: None})
+
+
+def test_reduction():
+    nodes = [Node(str(index)) for index in range(3)]
+    reduction = Reduction(Sum(), 3)
+    # Missing values
+    nodes[0].set_result(triplet(1., 0.1))
+    reduction.update(0, nodes[0])
+    assert reduction.result() is None
+    nodes[1].set_result(triplet(2., 0.3, AttrQuality.ATTR_ALARM))
+    nodes[2].set_result(triplet(3., 0.2))
+    reduction.update(1, nodes[1])
+    reduction.update(2, nodes[2])
+    assert reduction.exception() is None
+    assert reduction.result() == triplet(6., 0.3, AttrQuality.ATTR_ALARM)
+    # Quality change
+    nodes[1].set_result(triplet(2., 0.4))
+    reduction.update(1, nodes[1])
+    assert reduction.result() == triplet(6., 0.4, VALID)
+    # Invalid quality
+    nodes[2].set_result(triplet(None, 0.5, INVALID))
+    reduction.update(2, nodes[2])
+    assert reduction.result() == triplet(None, 0.5, INVALID)
+    # Exceptions
+    errors = RuntimeError('1'), RuntimeError('2')
+    for index, error in zip((2, 1), errors):
+        nodes[index].set_exception(error)
+        reduction.update(index, nodes[index])
+    assert reduction.exception() is errors[1]
+    # Recovery
+    for index in (1, 2):
+        nodes[index].set_result(triplet(4., 0.6))
+        reduction.update(index, nodes[index])
+    assert reduction.exception() is None
+    assert reduction.result() == triplet(9., 0.6, VALID)
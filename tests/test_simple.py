@@ -11,7 +11,7 @@ from tango.test_context import DeviceTestContext
 # Proxy imports
 from facadedevice.graph import VALID, INVALID, triplet
 from facadedevice import Facade, TimedFacade, state_attribute
-from facadedevice import local_attribute
+from facadedevice import local_attribute, logical_attribute
 
 
 def event_mock(mocker, cls):
@@ -64,6 +64,33 @@ def test_simple_device(mocker):
         archive_events['Status'].assert_called_with()  # *expected_status)
 
 
+def test_timed_device_transaction(mocker):
+
+    class Test(TimedFacade):
+
+        A = local_attribute(dtype=float)
+        B = local_attribute(dtype=float)
+
+        @logical_attribute(dtype=float, bind=['A', 'B'])
+        def C(self, a, b):
+            rule_mock(a, b)
+            return a + b
+
+        def on_time(self, value):
+            self.graph['A'].set_result(triplet(value))
+            self.graph['B'].set_result(triplet(2 * value))
+
+    rule_mock = mocker.Mock()
+    time.time
+    mocker.patch('time.time').return_value = 1.0
+    change_events, archive_events = event_mock(mocker, Test)
+
+    with DeviceTestContext(Test, debug=3) as proxy:
+        assert proxy.C == 3.
+        rule_mock.assert_called_once_with(1., 2.)
+        change_events['C'].assert_called_once_with(3., 1.0, VALID)
+
+
 def test_simple_device_no_status(mocker):
 
     class Test(TimedFacade):